@@ -0,0 +1,248 @@
+"""A fake RouterOS API server, for tests and load tests.
+
+It speaks enough of the API protocol for :mod:`inkirinet.routeros`: logins
+always succeed, DHCP leases live in memory and every IP address asking for
+its lease gets a bound dynamic one with a MAC address derived from the IP.
+Queue types, queue trees and mangle rules are kept in memory too, but do
+nothing, and print booleans and durations back as RouterOS does.  Scripts run only the lease operations of
+:func:`inkirinet.routeros.render_lease_script`.
+"""
+
+import hashlib
+import os
+import re
+import socket
+import socketserver
+import ssl
+import threading
+import time
+
+from .routeros import ApiRos
+from .routeros import parse_sentence
+
+
+# A self-signed certificate (and its key) for API-SSL.
+TEST_CERTFILE = os.path.join(os.path.dirname(__file__), 'testdata', 'fakerouter.pem')
+
+
+def mac_address_for_ip(ip_address):
+    """Return the MAC address the fake router assigns to an IPv4 address."""
+    return '02:00:' + ':'.join(f'{int(octet):02X}' for octet in ip_address.split('.'))
+
+
+_SCRIPT_OPERATION_RE = re.compile(
+    r':do \{ /ip dhcp-server lease (add|set|remove)( \*[0-9A-F]+)?(.*?); :set applied')
+
+_SCRIPT_ATTRIBUTE_RE = re.compile(r' ([a-z][a-z0-9-]*)="((?:[^"\\]|\\.)*)"')
+
+_SCRIPT_ESCAPES = {'n': '\n', 'r': '\r', 't': '\t'}
+
+
+def printed_value(value):
+    """Return a value as RouterOS prints it, e.g. ``no`` as ``false`` and
+    ``90s`` as ``1m30s``."""
+    if value in ('yes', 'no'):
+        return 'true' if value == 'yes' else 'false'
+    match = re.fullmatch(r'(\d+)s', value)
+    if match is None:
+        return value
+    minutes, seconds = divmod(int(match[1]), 60)
+    hours, minutes = divmod(minutes, 60)
+    return ''.join(f'{n}{unit}' for n, unit in ((hours, 'h'), (minutes, 'm'), (seconds, 's'))
+                   if n) or '0s'
+
+
+def _unquote_script_string(value):
+    return re.sub(r'\\(.)', lambda m: _SCRIPT_ESCAPES.get(m[1], m[1]), value)
+
+
+class FakeRouter(socketserver.ThreadingTCPServer):
+    """A RouterOS API server on ``127.0.0.1``, started in a background thread.
+
+    :param latency: Seconds to wait before answering each command.
+    :param certfile: Serve API-SSL with this certificate (and key), e.g.
+                     :data:`TEST_CERTFILE`.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    # Menus (besides DHCP leases) with plain print, add, set and remove.
+    TABLES = ('/queue/type', '/queue/tree', '/ip/firewall/mangle', '/system/script')
+
+    def __init__(self, latency=0.0, certfile=None):
+        super().__init__(('127.0.0.1', 0), FakeRouterHandler)
+        self.latency = latency
+        self.certfile = certfile
+        self.tls_context = None
+        if certfile is not None:
+            self.tls_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.tls_context.load_cert_chain(certfile)
+        self.leases = {}
+        self.tables = {table: {} for table in self.TABLES}
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.commands = 0
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def connection_settings(self):
+        """Return the settings to connect, as in ``settings.ROUTEROS_API``."""
+        settings = {'host': '127.0.0.1',
+                    'port': self.port,
+                    'username': 'fake',
+                    'password': 'fake',
+                    'disable_ssl': self.certfile is None}
+        if self.certfile is not None:
+            with open(self.certfile) as f:
+                pem = f.read()
+            end = pem.index(ssl.PEM_FOOTER) + len(ssl.PEM_FOOTER)
+            certificate = ssl.PEM_cert_to_DER_cert(pem[:end])
+            settings['ssl_fingerprint'] = hashlib.sha256(certificate).hexdigest()
+        return settings
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       args=(0.05,),
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+    def add_lease(self, **attrs):
+        with self.lock:
+            lease_id = f'*{self.next_id:X}'
+            self.next_id += 1
+            self.leases[lease_id] = {'.id': lease_id, **attrs}
+            return lease_id
+
+    def execute(self, command, attrs, queries):
+        """Return the reply sentences for a command."""
+        with self.lock:
+            self.commands += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if command == '/login':
+            return []
+        if command == '/ip/dhcp-server/lease/print':
+            return [['!re'] + [f'={k}={v}' for k, v in lease.items()]
+                    for lease in self.find_leases(queries)]
+        if command == '/ip/dhcp-server/lease/add':
+            attrs.setdefault('dynamic', 'false')
+            return [['!done', f'=ret={self.add_lease(**attrs)}']]
+        if command == '/ip/dhcp-server/lease/set':
+            with self.lock:
+                lease = self.leases.get(attrs.get('.id'))
+                if lease is not None:
+                    lease.update(attrs)
+            if lease is None:
+                return [['!trap', '=message=no such item']]
+            return []
+        if command == '/ip/dhcp-server/lease/remove':
+            with self.lock:
+                missing = [i for i in attrs.get('.id', '').split(',')
+                           if self.leases.pop(i, None) is None]
+            if missing:
+                return [['!trap', '=message=no such item (4)']]
+            return []
+        if command == '/system/script/run':
+            return self.run_script(attrs.get('.id'))
+        table, _, action = command.rpartition('/')
+        if table in self.tables:
+            return self.execute_table(self.tables[table], action, attrs, queries)
+        return [['!trap', f'=message=no such command: {command}']]
+
+    def execute_table(self, items, action, attrs, queries):
+        attrs = {k: printed_value(v) for k, v in attrs.items()}
+        with self.lock:
+            if action == 'print':
+                return [['!re'] + [f'={k}={v}' for k, v in item.items()]
+                        for item in items.values()
+                        if all(item.get(k) == v for k, v in queries.items())]
+            if action == 'add':
+                item_id = f'*{self.next_id:X}'
+                self.next_id += 1
+                items[item_id] = {'.id': item_id, **attrs}
+                return [['!done', f'=ret={item_id}']]
+            if action in ('set', 'remove') and attrs.get('.id') in items:
+                if action == 'set':
+                    items[attrs['.id']].update(attrs)
+                else:
+                    del items[attrs['.id']]
+                return []
+        return [['!trap', '=message=no such item']]
+
+    def run_script(self, script_id):
+        """Run a lease script, counting the operations as RouterOS would."""
+        with self.lock:
+            script = self.tables['/system/script'].get(script_id)
+        if script is None:
+            return [['!trap', '=message=no such item']]
+        applied = failed = 0
+        for action, lease_id, words in _SCRIPT_OPERATION_RE.findall(script['source']):
+            attrs = {k: _unquote_script_string(v)
+                     for k, v in _SCRIPT_ATTRIBUTE_RE.findall(words)}
+            if lease_id:
+                attrs['.id'] = lease_id.strip()
+            replies = self.execute(f'/ip/dhcp-server/lease/{action}', attrs, {})
+            if any(reply[0] == '!trap' for reply in replies):
+                failed += 1
+            else:
+                applied += 1
+        with self.lock:
+            script['comment'] = f'inkirinet applied={applied} failed={failed}'
+        return []
+
+    def find_leases(self, queries):
+        active_address = queries.get('active-address')
+        if active_address is not None:
+            # Every client asking has a bound dynamic lease.
+            return [{'.id': '*FFFFFFFF',
+                     'mac-address': mac_address_for_ip(active_address),
+                     'active-address': active_address,
+                     'address': active_address,
+                     'dynamic': 'true',
+                     'status': 'bound'}]
+        with self.lock:
+            return [dict(lease) for lease in self.leases.values()
+                    if all(lease.get(k) == v for k, v in queries.items())]
+
+
+class FakeRouterHandler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        # Replies are written a word at a time.
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.server.tls_context is not None:
+            self.request = self.server.tls_context.wrap_socket(self.request,
+                                                               server_side=True)
+
+    def handle(self):
+        api = ApiRos(self.request)
+        while True:
+            try:
+                sentence = api.readSentence()
+            except (OSError, RuntimeError):
+                return
+            if not sentence:
+                continue
+            command, attrs = parse_sentence(sentence)
+            queries = {}
+            for word in sentence[1:]:
+                # Both "?name=value" and "?=name=value".
+                if word.startswith('?'):
+                    key, _, value = word[1:].lstrip('=').partition('=')
+                    queries[key] = value
+            attrs = {k: v for k, v in attrs.items() if not k.startswith('?')}
+            replies = self.server.execute(command, attrs, queries)
+            if not replies or replies[-1][0] != '!done':
+                replies.append(['!done'])
+            for reply in replies:
+                api.writeSentence(reply)
@@ -0,0 +1,89 @@
+"""Snapshots of a router's leases table, to restart without downloading it.
+
+The file is a header (magic, version, lease count and the attributes stored,
+so a snapshot of other attributes isn't misread) followed by each lease's
+attributes as length prefixed UTF-8 strings, read through ``mmap``.
+"""
+
+import logging
+import mmap
+import os
+import struct
+
+from .routeros import Lease
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'IKLS'
+
+VERSION = 1
+
+_HEADER = struct.Struct('<4sHIH')
+
+_LENGTH = struct.Struct('<H')
+
+# Length of attributes missing in the lease, longer values can't be stored.
+_NONE = 0xFFFF
+
+
+def save(path, leases):
+    """Write the ``leases`` (by id) to ``path``, replacing it atomically."""
+    attributes = Lease.PROPLIST.encode('utf-8')
+    data = bytearray(_HEADER.pack(MAGIC, VERSION, len(leases), len(attributes)))
+    data += attributes
+    for lease in leases.values():
+        for key in Lease.ATTRIBUTES:
+            value = lease.get(key)
+            if value is None:
+                data += _LENGTH.pack(_NONE)
+                continue
+            value = value.encode('utf-8')
+            if len(value) >= _NONE:
+                raise ValueError(f"Lease attribute too long for a snapshot: {key}={value[:80]}...")
+            data += _LENGTH.pack(len(value))
+            data += value
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(data)
+    os.replace(temporary_path, path)
+
+
+def load(path):
+    """Return the leases (by id) saved in ``path``.
+
+    :return: ``None`` if there is no snapshot or it can't be read.
+    """
+    try:
+        with open(path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _parse(data)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, struct.error) as error:
+        logger.warning('ignoring unreadable lease snapshot: path=%s error=%s', path, error)
+        return None
+
+
+def _parse(data):
+    magic, version, count, attributes_length = _HEADER.unpack_from(data, 0)
+    offset = _HEADER.size
+    attributes = bytes(data[offset:offset + attributes_length]).decode('utf-8')
+    offset += attributes_length
+    if magic != MAGIC or version != VERSION or attributes != Lease.PROPLIST:
+        raise ValueError(f'not a version {VERSION} snapshot of {Lease.PROPLIST}')
+    keys = tuple(Lease.ATTRIBUTES)
+    leases = {}
+    for _ in range(count):
+        lease = Lease()
+        for key in keys:
+            length, = _LENGTH.unpack_from(data, offset)
+            offset += _LENGTH.size
+            if length == _NONE:
+                continue
+            if offset + length > len(data):
+                raise ValueError('truncated snapshot')
+            lease[key] = data[offset:offset + length].decode('utf-8')
+            offset += length
+        leases[lease.id] = lease
+    return leases
@@ -0,0 +1,37 @@
+"""MAC addresses in a single canonical form.
+
+Devices, router leases and the lease cache all key MAC addresses as
+``'AA:BB:CC:DD:EE:FF'`` (uppercase, colon separated), so matching them is a
+plain string (or index) comparison.
+"""
+
+import re
+
+
+_MAC_ADDRESS_RE = re.compile(r'\s*([0-9A-F]{2})[:-]?([0-9A-F]{2})[:.-]?([0-9A-F]{2})[:-]?'
+                             r'([0-9A-F]{2})[:.-]?([0-9A-F]{2})[:-]?([0-9A-F]{2})\s*$',
+                             re.IGNORECASE)
+
+
+def normalize(mac_address):
+    """Return ``mac_address`` in the canonical form.
+
+    Accepts colons, dashes, Cisco style dots or no separators at all, in any
+    case.
+
+    :raise ValueError: If ``mac_address`` isn't a MAC address.
+    """
+    match = _MAC_ADDRESS_RE.match(mac_address)
+    if match is None:
+        raise ValueError(f"Invalid MAC address: '{mac_address}'.")
+    return ':'.join(match.groups()).upper()
+
+
+def normalize_or_keep(mac_address):
+    """Like :func:`normalize`, but return anything else unchanged."""
+    if not mac_address:
+        return mac_address
+    try:
+        return normalize(mac_address)
+    except ValueError:
+        return mac_address
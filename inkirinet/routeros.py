@@ -1,16 +1,35 @@
+import asyncio
 import binascii
 import contextlib
+import contextvars
 import hashlib
 import logging
+import re
 import select
 import socket
 import ssl
 import sys
+import time
+import uuid
+
+from . import macaddress
 
 
 logger = logging.getLogger(__name__)
 
 
+class RouterOSError(Exception):
+    """The RouterOS API failed or replied with an error."""
+
+
+class RouterOSTimeoutError(RouterOSError, TimeoutError):
+    """The router didn't answer in time, its connection was closed."""
+
+
+class RouterOSConnectionError(RouterOSError, ConnectionError):
+    """The router couldn't be reached or its connection was lost."""
+
+
 class Mikrotik:
     """A wrapper around Mikrotik's API offering operations pertaining Inkirinet."""
 
@@ -23,47 +42,160 @@ class Mikrotik:
 
     LEASE_COMMENT_SUFFIX = '@inkirinet'
 
-    def __init__(self, api):
+    # Queue mode's names (of address lists, queue types, packet marks and
+    # queues) for each plan start with it.
+    QUEUE_PREFIX = 'inkirinet-'
+
+    def __init__(self, api, *, lease_cache=None, queue_mode=False):
         self.api = api
         self.leases = {}
+        self.lease_cache = lease_cache
+        self.queue_mode = queue_mode
+
+    @contextlib.contextmanager
+    def deadline(self, seconds):
+        """Limit the time all the operations inside the block can take.
+
+        :raise RouterOSTimeoutError: If the router takes longer, the
+                                     connection can't be used afterwards.
+        """
+        previous = self.api.deadline
+        deadline = time.monotonic() + seconds
+        self.api.deadline = deadline if previous is None else min(previous, deadline)
+        try:
+            yield self
+        finally:
+            self.api.deadline = previous
+
+    @property
+    def leases(self):
+        """The leases table, by lease id, as of the last poll."""
+        return self._leases
+
+    @leases.setter
+    def leases(self, leases):
+        self._leases = leases
+        # True once leases were added, set or removed through this object,
+        # then the table is out of date until the next poll.
+        self.leases_changed = False
+        # Lease ids by canonical MAC address (as in :class:`Lease`), see
+        # :mod:`inkirinet.macaddress`.
+        self._lease_ids_by_mac_address = {}
+        for lease_id, lease in leases.items():
+            mac_address = lease.get('mac-address')
+            if mac_address:
+                self._lease_ids_by_mac_address.setdefault(mac_address, []).append(lease_id)
+
+    def _leases_by_mac_address(self, mac_address):
+        for lease_id in self._lease_ids_by_mac_address.get(
+                macaddress.normalize_or_keep(mac_address), ()):
+            yield self._leases[lease_id]
 
     def query_leases(self):
         """Query mikrotik's for all DHCP leases and return.
 
         :return: A dictionary containing all leases, where the key is the lease
-                 id and the value is a dictionary with the lease attributes.
+                 id and the value is a :class:`Lease`.
         """
         leases = {}
-        for code, attrs in self.api.talk(['/ip/dhcp-server/lease/print']):
-            if code == '!done':
-                break
-            if attrs['.id'] in leases:
-                raise Exception(f"found two leases with the same id: "
-                                f"one={attrs} two={leases[attrs['.id']]}")
-            leases[attrs['.id']] = attrs
+        duplicate = None
+        for words in self._print(['/ip/dhcp-server/lease/print',
+                                  f'=.proplist={Lease.PROPLIST}']):
+            lease = Lease.from_words(words)
+            if lease.id in leases and duplicate is None:
+                duplicate = RouterOSError(f"found two leases with the same id: "
+                                          f"one={lease} two={leases[lease.id]}")
+            leases[lease.id] = lease
+        if duplicate is not None:
+            raise duplicate
         return leases
 
-    def poll_leases(self):
+    def _print(self, words):
+        """Yield the attribute words of each ``!re`` reply to a print.
+
+        All the replies are read (up to ``!done``) before raising if the
+        print failed, so the next command doesn't read them as its own.
+        """
+        error = None
+        for sentence in self.api.talk_sentences(words):
+            if sentence[0] == '!re':
+                if error is None:
+                    yield sentence[1:]
+            elif sentence[0] == '!done':
+                break
+            elif error is None:
+                error = RouterOSError(f'call to api failed: {parse_sentence(sentence)}')
+                if sentence[0] == '!fatal':
+                    # The router closes the connection, there is no !done.
+                    raise error
+        if error is not None:
+            raise error
+
+    # Attributes that change when a lease is bound, released or given to
+    # another device: a cheap check for changes.
+    MARKER_PROPLIST = '.id,status,mac-address,active-address'
+
+    @staticmethod
+    def lease_marker(lease):
+        return lease.status, lease.mac_address, lease.active_address
+
+    def query_lease_markers(self):
+        """Query the :meth:`lease_marker` of all the DHCP leases, by lease id."""
+        markers = {}
+        for words in self._print(['/ip/dhcp-server/lease/print',
+                                  f'=.proplist={self.MARKER_PROPLIST}']):
+            lease = Lease.from_words(words)
+            markers[lease.id] = self.lease_marker(lease)
+        return markers
+
+    def poll_leases(self, *, full=True):
         """Query Mikrotik's DHCP leases and update the internal leases table.
 
+        :param full: If false, query the leases' ids, status and addresses
+                     first and only download the leases if some of those
+                     changed, or leases were changed through this object
+                     since.  Then changes in other attributes (e.g. the rate
+                     limit) made elsewhere go unnoticed.  Useful right after
+                     loading the table from a snapshot.
         :return: A tuple with two lists with lease ids: The first one for
                  leases that were added since last poll and the second one
                  for leaseas that were removed since last poll.
         """
+        if not full and not self.leases_changed and self.query_lease_markers() == {
+                lease_id: self.lease_marker(lease) for lease_id, lease in self.leases.items()}:
+            if self.lease_cache is not None:
+                self.lease_cache.update(self.leases, self.leases)
+            return set(), set()
         leases = self.query_leases()
         new_keys = leases.keys() - self.leases.keys()
         deleted_keys = self.leases.keys() - leases.keys()
+        if self.lease_cache is not None:
+            self.lease_cache.update(self.leases, leases)
         self.leases = leases
         return new_keys, deleted_keys
 
-    def create_static_lease(self, address_pool, email, device, rate):
-        """Create a static lease in the address pool specified and rate."""
+    def static_lease(self, address_pool, email, device, rate):
+        """Return the attributes of a device's static lease."""
         lease = {
             'address': address_pool,
-            'mac-address': device.upper(),
+            'mac-address': macaddress.normalize_or_keep(device),
             'rate-limit': self.RATE_LIMIT[rate],
+            'address-lists': '',
             'comment': f'{rate} {email} {self.LEASE_COMMENT_SUFFIX}'
         }
+        if self.queue_mode:
+            # The plan's queues limit the lease, through its address list.
+            lease['rate-limit'] = ''
+            lease['address-lists'] = self.plan_address_list(rate)
+        return lease
+
+    def create_static_lease(self, address_pool, email, device, rate, changeset=None):
+        """Create a static lease in the address pool specified and rate.
+
+        :param changeset: A :class:`LeaseChangeset` to add the operations to,
+                          instead of running them.
+        """
+        lease = self.static_lease(address_pool, email, device, rate)
         static_lease = self.get_static_lease_by_mac_address(
             lease['address'],
             lease['mac-address'],
@@ -71,97 +203,581 @@ class Mikrotik:
         if static_lease:
             logger.info('static lease already created: %s', static_lease)
             if static_lease['comment'].strip().endswith(self.LEASE_COMMENT_SUFFIX):
-                for reply, attrs in self.api.talk(
-                        ['/ip/dhcp-server/lease/set',
-                         f"=.id={static_lease['.id']}",
-                         f"=address={lease['address']}",
-                         f"=mac-address={lease['mac-address']}",
-                         f"=rate-limit={lease['rate-limit']}",
-                         f"=comment={lease['comment']}"]):
-                    if reply == '!done':
-                        break
-                    else:
-                        raise Exception(f"Failed to set lease: lease='{lease}': {reply} {attrs}")
+                self._set_lease(static_lease['.id'], lease, changeset)
+        elif changeset is not None:
+            changeset.add(**lease)
         else:
             logger.info('creating static lease')
             for reply, attrs in self.api.talk(
-                    ['/ip/dhcp-server/lease/add',
-                     f"=address={lease['address']}",
-                     f"=mac-address={lease['mac-address']}",
-                     f"=rate-limit={lease['rate-limit']}",
-                     f"=comment={lease['comment']}"]):
+                    ['/ip/dhcp-server/lease/add']
+                    + [f'={k}={v}' for k, v in lease.items()]):
                 if reply == '!done':
+                    self.leases_changed = True
                     break
                 else:
-                    raise Exception(f"Failed to add lease: lease='{lease}': {reply} {attrs}")
+                    raise RouterOSError(f"Failed to add lease: lease='{lease}': {reply} {attrs}")
 
         # Remove all the dynamic leases.
 
-        for lease in self.list_dynamic_leases_by_mac_address(lease['mac-address']):
-            self.remove_lease(lease)
+        self.remove_leases((lease['.id'] for lease in
+                            self.list_dynamic_leases_by_mac_address(lease['mac-address'])),
+                           changeset)
 
-    def remove_static_lease(self, address_pool, mac_address):
-        static_lease = self.get_static_lease_by_mac_address(
-            address_pool,
-            mac_address.upper(),
-            ('.id', 'rate-limit', 'comment'))
-        if static_lease:
-            self.remove_lease(static_lease)
+    def update_static_lease(self, address_pool, email, device, rate, changeset=None):
+        """Set a device's static lease as in :meth:`static_lease`, if it differs.
+
+        E.g. after a plan changed, or queue mode was turned on or off.  Only
+        the leases created by Inkirinet are changed.
+
+        :param changeset: As in :meth:`create_static_lease`.
+        :return: True if the lease was updated, or its update added to the
+                 ``changeset``.
+        """
+        lease = self.static_lease(address_pool, email, device, rate)
+        static_lease = self._static_lease(address_pool, lease['mac-address'])
+        if (static_lease is None
+                or not static_lease.get('comment', '').strip().endswith(self.LEASE_COMMENT_SUFFIX)
+                or all(static_lease.get(k, '') == v for k, v in lease.items())):
+            return False
+        self._set_lease(static_lease['.id'], lease, changeset)
+        return True
+
+    def _set_lease(self, lease_id, lease, changeset=None):
+        if changeset is not None:
+            changeset.set(lease_id, **lease)
+            return
+        for reply, attrs in self.api.talk(['/ip/dhcp-server/lease/set', f'=.id={lease_id}']
+                                          + [f'={k}={v}' for k, v in lease.items()]):
+            if reply == '!done':
+                self.leases_changed = True
+                break
+            else:
+                raise RouterOSError(f"Failed to set lease: lease='{lease}': {reply} {attrs}")
+
+    def remove_static_lease(self, address_pool, mac_address, changeset=None):
+        self.remove_static_leases(address_pool, [mac_address], changeset)
+
+    def remove_static_leases(self, address_pool, mac_addresses, changeset=None):
+        """Remove the static leases of many devices, e.g. a whole contract."""
+        self.remove_leases((static_lease['.id'] for static_lease in (
+            self.get_static_lease_by_mac_address(address_pool, mac_address)
+            for mac_address in mac_addresses) if static_lease), changeset)
 
     def remove_lease(self, lease):
+        self.remove_leases([lease['.id']])
+
+    # Ids per remove command, keeps each sentence a reasonable size.
+    REMOVE_BATCH_SIZE = 200
+
+    def remove_leases(self, lease_ids, changeset=None):
+        """Remove leases by id, many per command.
+
+        Leases already gone (RouterOS's "no such item") count as removed.
+
+        :param changeset: A :class:`LeaseChangeset` to add the removals to,
+                          instead of running them.
+        """
+        if changeset is not None:
+            for lease_id in lease_ids:
+                changeset.remove(lease_id)
+            return
+        lease_ids = list(lease_ids)
+        for i in range(0, len(lease_ids), self.REMOVE_BATCH_SIZE):
+            batch = lease_ids[i:i + self.REMOVE_BATCH_SIZE]
+            if not self._remove_leases(batch) and len(batch) > 1:
+                # Some lease in the batch is gone, which fails the command,
+                # find out about the others one by one.
+                for lease_id in batch:
+                    self._remove_leases([lease_id])
+
+    def _remove_leases(self, lease_ids):
+        """Return ``False`` if some lease was not found."""
         for reply, attrs in self.api.talk(['/ip/dhcp-server/lease/remove',
-                                           f"=.id={lease['.id']}"]):
+                                           f"=.id={','.join(lease_ids)}"]):
             if reply == '!done':
-                return
-            elif reply == '!trap' and 'no such item (4)' in attrs['message']:
-                return
+                self.leases_changed = True
+                return True
+            elif reply == '!trap' and 'no such item' in attrs.get('message', ''):
+                return False
             else:
-                raise Exception(f"Failed to remove lease: "
-                                f"lease='{lease}' reply={reply} attrs={attrs}")
+                raise RouterOSError(f"Failed to remove leases: "
+                                    f"ids={lease_ids} reply={reply} attrs={attrs}")
+
+    def plan_address_list(self, plan):
+        """Return the address list of the static leases of a plan, in queue mode."""
+        return f'{self.QUEUE_PREFIX}{plan}'
+
+    def ensure_plan_queues(self):
+        """Create (or update) the queues shared by the static leases of each plan.
+
+        In queue mode, leases have no rate limit (and so no queue) of their
+        own, they join their plan's address list instead.  For each plan and
+        direction, a mangle rule marks the packets of the addresses in the
+        list and a queue tree of a PCQ queue type limits each address to the
+        plan's rate.  Changing a plan's rate only updates its queue types.
+        """
+        menus = {}
+        for path, key, value, attrs in self.plan_queue_items():
+            menus.setdefault((path, key), {})[value] = attrs
+        # The queue types and packet marks first, the queue trees use them.
+        for (path, key), items in menus.items():
+            self._ensure(path, key, items)
+
+    def plan_queue_items(self):
+        """Yield the ``(menu, key, value, attributes)`` of the plans' queues."""
+        for plan in self.RATE_LIMIT:
+            address_list = self.plan_address_list(plan)
+            rates = self.parse_rate_limit(self.RATE_LIMIT[plan])
+            for direction, classifier, address_list_key in (
+                    ('upload', 'src-address', 'src-address-list'),
+                    ('download', 'dst-address', 'dst-address-list')):
+                name = f'{address_list}-{direction}'
+                pcq = rates[direction]
+                yield ('/queue/type', 'name', name,
+                       {'kind': 'pcq',
+                        'pcq-classifier': classifier,
+                        'pcq-rate': pcq['rate'],
+                        'pcq-burst-rate': pcq['burst-rate'],
+                        'pcq-burst-threshold': pcq['burst-threshold'],
+                        'pcq-burst-time': pcq['burst-time']})
+                yield ('/ip/firewall/mangle', 'comment', name,
+                       {'chain': 'forward',
+                        address_list_key: address_list,
+                        'action': 'mark-packet',
+                        'new-packet-mark': name,
+                        'passthrough': 'no'})
+                yield ('/queue/tree', 'name', name,
+                       {'parent': 'global',
+                        'packet-mark': name,
+                        'queue': name})
+
+    @staticmethod
+    def parse_rate_limit(rate_limit):
+        """Return the PCQ rates of each direction in a lease's rate limit.
+
+        :param rate_limit: As in :attr:`RATE_LIMIT`, ``"rx/tx burst-rx/tx
+                           threshold-rx/tx burst-time priority limit-at"``,
+                           where rx is the client's upload.
+        """
+        fields = rate_limit.split()
+        rates = {'upload': {}, 'download': {}}
+        for key, field in zip(('rate', 'burst-rate', 'burst-threshold', 'burst-time'), fields):
+            upload, _, download = field.partition('/')
+            download = download or upload
+            if key == 'burst-time':
+                upload, download = f'{upload}s', f'{download}s'
+            rates['upload'][key] = upload
+            rates['download'][key] = download
+        return rates
+
+    def _ensure(self, path, key, items):
+        """Add the items missing at ``path`` and set those that differ.
+
+        :param items: The attributes of each item, by its ``key`` value.
+
+        The menu is printed once, the items already alike aren't touched.
+        Values are compared as in :func:`canonical_value`, RouterOS prints
+        them in its own format.
+        """
+        proplist = {'.id', key}
+        for attrs in items.values():
+            proplist.update(attrs)
+        existing = {}
+        for code, item in self._call([f'{path}/print', f"=.proplist={','.join(sorted(proplist))}"],
+                                     f'print {path}'):
+            if code == '!re':
+                existing.setdefault(item.get(key), item)
+        for value, attrs in items.items():
+            words = [f'={k}={v}' for k, v in {key: value, **attrs}.items()]
+            item = existing.get(value)
+            if item is None:
+                logger.info('creating %s %s', path, value)
+                self._call([f'{path}/add'] + words, f'add {path} {value}')
+            elif any(canonical_value(item.get(k)) != canonical_value(v)
+                     for k, v in attrs.items()):
+                self._call([f'{path}/set', f"=.id={item['.id']}"] + words,
+                           f'set {path} {value}')
+
+    # Operations per script, keeps each script's source a reasonable size.
+    SCRIPT_BATCH_SIZE = 500
+
+    def apply_lease_changeset(self, changeset):
+        """Apply a :class:`LeaseChangeset` on the router, as scripts.
+
+        Instead of a command per operation, the operations are uploaded as a
+        script (or a few, for large changesets), run once and removed.  Use
+        it for large changes, e.g. a plan's rate limit, over slow links.
+
+        :return: A tuple with the number of operations applied and the
+                 number that failed.
+        """
+        applied = failed = 0
+        operations = changeset.operations
+        for i in range(0, len(operations), self.SCRIPT_BATCH_SIZE):
+            batch_applied, batch_failed = self._run_lease_script(
+                operations[i:i + self.SCRIPT_BATCH_SIZE])
+            applied += batch_applied
+            failed += batch_failed
+            if batch_applied:
+                self.leases_changed = True
+        return applied, failed
+
+    def _run_lease_script(self, operations):
+        name = f'inkirinet-{uuid.uuid4().hex}'
+        script_id = self._call(['/system/script/add',
+                                f'=name={name}',
+                                f'=source={render_lease_script(operations, name)}'],
+                               'add script')[-1][1]['ret']
+        try:
+            self._call(['/system/script/run', f'=.id={script_id}'], 'run script')
+            replies = self._call(['/system/script/print',
+                                  f'?.id={script_id}',
+                                  '=.proplist=comment'],
+                                 'read script result')
+        finally:
+            self._call(['/system/script/remove', f'=.id={script_id}'], 'remove script')
+        for code, attrs in replies:
+            match = _SCRIPT_RESULT_RE.match(attrs.get('comment', ''))
+            if code == '!re' and match:
+                logger.info('lease script %s: applied=%s failed=%s', name, *match.groups())
+                return int(match[1]), int(match[2])
+        raise RouterOSError(f"Lease script did not finish: name={name} replies={replies}")
+
+    def _call(self, words, action):
+        """Talk to the API and return the replies, or raise if it failed."""
+        replies = self.api.talk(words)
+        for code, attrs in replies:
+            if code not in ('!re', '!done'):
+                raise RouterOSError(f"Failed to {action}: reply={code} attrs={attrs}")
+        return replies
 
     def list_dynamic_leases_by_mac_address(self, mac_address, keys=None):
         if keys is None:
             keys = ['.id']
         ret = []
-        for lease in self.leases.values():
-            if (lease['dynamic'] == 'true'
-                    and lease.get('mac-address', '').upper() == mac_address.upper()):
+        for lease in self._leases_by_mac_address(mac_address):
+            if lease['dynamic'] == 'true':
                 ret.append({k: lease[k] for k in keys})
         return ret
 
     def get_static_lease_by_mac_address(self, address_pool, mac_address, keys=None):
         if keys is None:
             keys = ['.id']
-        ret = []
-        for lease in self.leases.values():
-            if (lease['address'] == address_pool
-                    and lease['dynamic'] == 'false'
-                    and lease['mac-address'].upper() == mac_address.upper()):
-                ret.append({k: lease[k] for k in keys})
-        return ret[0] if ret else None
+        lease = self._static_lease(address_pool, mac_address)
+        return None if lease is None else {k: lease[k] for k in keys}
+
+    def _static_lease(self, address_pool, mac_address):
+        for lease in self._leases_by_mac_address(mac_address):
+            if lease['address'] == address_pool and lease['dynamic'] == 'false':
+                return lease
+        return None
 
     def get_mac_address_by_dynamic_ip(self, ip_address):
         """Find the dynamic lease that has :param:`ip_address` as the active address."""
-        for code, attrs in self.api.talk(['/ip/dhcp-server/lease/print',
-                                          '?=status=bound',
-                                          '?=dynamic=true',
-                                          f'?=active-address={ip_address}',
-                                          '=.proplist=mac-address']):
+        return self._parse_mac_address_reply(
+            self.api.talk(self._mac_address_by_dynamic_ip_query(ip_address)))
+
+    @staticmethod
+    def _mac_address_by_dynamic_ip_query(ip_address):
+        return ['/ip/dhcp-server/lease/print',
+                '?=status=bound',
+                '?=dynamic=true',
+                f'?=active-address={ip_address}',
+                '=.proplist=mac-address']
+
+    @staticmethod
+    def _parse_mac_address_reply(replies):
+        for code, attrs in replies:
             if code == '!re':
-                return attrs['mac-address']
+                return macaddress.normalize_or_keep(attrs['mac-address'])
             if code == '!done':
                 break
-            raise Exception(f'call to api failed: {code} {attrs}')
+            raise RouterOSError(f'call to api failed: {code} {attrs}')
         return None
 
 
+class Lease:
+    """A DHCP lease, with only the attributes Inkirinet uses.
+
+    Attributes are read as in RouterOS, e.g. ``lease['mac-address']``, or
+    ``lease.mac_address``.  Those missing in the router's reply are ``None``
+    (and a ``KeyError`` as items).  Values repeated among leases (flags,
+    status, rate limits...) are interned, and MAC addresses are canonical.
+    """
+
+    __slots__ = ('id', 'address', 'mac_address', 'active_address', 'dynamic',
+                 'status', 'rate_limit', 'address_lists', 'comment')
+
+    # RouterOS attribute -> slot.
+    ATTRIBUTES = {'.id': 'id',
+                  'address': 'address',
+                  'mac-address': 'mac_address',
+                  'active-address': 'active_address',
+                  'dynamic': 'dynamic',
+                  'status': 'status',
+                  'rate-limit': 'rate_limit',
+                  'address-lists': 'address_lists',
+                  'comment': 'comment'}
+
+    # Few distinct values, unlike addresses.
+    INTERNED = frozenset(('dynamic', 'status', 'rate_limit', 'address_lists'))
+
+    # Ask the router for the attributes above only.
+    PROPLIST = ','.join(ATTRIBUTES)
+
+    def __init__(self, **attrs):
+        for slot in self.__slots__:
+            setattr(self, slot, None)
+        for key, value in attrs.items():
+            self[key] = value
+
+    @classmethod
+    def from_words(cls, words):
+        """Build a lease from the ``=attribute=value`` words of a reply."""
+        lease = cls()
+        for w in words:
+            j = w.find('=', 1)
+            if j != -1:
+                lease[w[1:j]] = w[j + 1:]
+        return lease
+
+    def __setitem__(self, key, value):
+        slot = self.ATTRIBUTES.get(key)
+        if slot is None:
+            return
+        if slot == 'mac_address':
+            value = macaddress.normalize_or_keep(value)
+        elif slot in self.INTERNED:
+            value = sys.intern(value)
+        setattr(self, slot, value)
+
+    def __getitem__(self, key):
+        value = getattr(self, self.ATTRIBUTES[key])
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        slot = self.ATTRIBUTES.get(key)
+        value = None if slot is None else getattr(self, slot)
+        return default if value is None else value
+
+    def __eq__(self, other):
+        if not isinstance(other, Lease):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self):
+        return 'Lease({})'.format(', '.join(f'{key}={getattr(self, slot)!r}'
+                                            for key, slot in self.ATTRIBUTES.items()
+                                            if getattr(self, slot) is not None))
+
+
+class LeaseCache:
+    """A cache of MAC addresses by IP address of bound dynamic leases.
+
+    It is filled in bulk by :meth:`Mikrotik.poll_leases`, so looking up the
+    device behind an IP address doesn't need a round trip to the router.  The
+    polled table is written as a whole under a single key, a write per poll
+    however large the table is, and only read again by a process when its
+    version changed.
+
+    :param cache: A cache implementing Django's cache API, it must be shared
+                  between the processes polling leases and the ones reading.
+    :param timeout: Seconds until entries expire, keep it short, an IP address
+                    might be handed to another device once its lease expires.
+    """
+
+    # Addresses looked up in the router between polls, one key each.
+    KEY_PREFIX = 'routeros:mac-address:'
+
+    # The polled table, as a (version, MAC addresses by IP address) tuple, and
+    # its version alone.
+    TABLE_KEY = 'routeros:mac-addresses'
+    VERSION_KEY = 'routeros:mac-addresses:version'
+
+    # The table last read in this process, by any instance.
+    _table = (None, {})
+
+    def __init__(self, cache, timeout=120, *, clock=time.monotonic):
+        self.cache = cache
+        self.timeout = timeout
+        self.clock = clock
+        self._refreshed_at = None
+
+    def get_mac_address(self, ip_address):
+        version = self.cache.get(self.VERSION_KEY)
+        if version is not None:
+            if LeaseCache._table[0] != version:
+                LeaseCache._table = self.cache.get(self.TABLE_KEY, (None, {}))
+            mac_address = LeaseCache._table[1].get(ip_address)
+            if mac_address is not None:
+                return mac_address
+        return self.cache.get(self.KEY_PREFIX + ip_address)
+
+    def set_mac_address(self, ip_address, mac_address):
+        self.cache.set(self.KEY_PREFIX + ip_address, mac_address, self.timeout)
+
+    def update(self, old_leases, new_leases):
+        """Cache the bound leases and forget the addresses no longer bound.
+
+        The table is written if it changed, and every half ``timeout`` before
+        it expires.
+        """
+        old = self._mac_addresses_by_ip(old_leases)
+        new = self._mac_addresses_by_ip(new_leases)
+        stale = old.keys() - new.keys()
+        if stale:
+            self.cache.delete_many([self.KEY_PREFIX + ip for ip in stale])
+        now = self.clock()
+        if (new != old or self._refreshed_at is None
+                or now - self._refreshed_at >= self.timeout / 2):
+            self._refreshed_at = now
+            version = uuid.uuid4().hex
+            # The table first, a reader never sees a version without it.
+            self.cache.set_many({self.TABLE_KEY: (version, new),
+                                 self.VERSION_KEY: version},
+                                self.timeout)
+
+    @staticmethod
+    def _mac_addresses_by_ip(leases):
+        return {lease['active-address']: macaddress.normalize_or_keep(lease['mac-address'])
+                for lease in leases.values()
+                if (lease.get('dynamic') == 'true'
+                    and lease.get('status') == 'bound'
+                    and lease.get('active-address')
+                    and lease.get('mac-address'))}
+
+
+class LeaseChangeset:
+    """DHCP lease operations, to apply in bulk with :meth:`Mikrotik.apply_lease_changeset`."""
+
+    def __init__(self):
+        self.operations = []
+
+    def __len__(self):
+        return len(self.operations)
+
+    def add(self, **attrs):
+        """Add a lease, attributes are given as in RouterOS with ``_`` for ``-``."""
+        self.operations.append(('add', None, attrs))
+
+    def set(self, lease_id, **attrs):
+        self.operations.append(('set', lease_id, attrs))
+
+    def remove(self, lease_id):
+        self.operations.append(('remove', lease_id, {}))
+
+
+_DURATION_RE = re.compile(r'(?:(\d+)w)?(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?'
+                          r'(?:(\d+)ms)?$')
+
+# Milliseconds per week, day, hour, minute, second and millisecond.
+_DURATION_UNITS = (7 * 86400000, 86400000, 3600000, 60000, 1000, 1)
+
+_CLOCK_RE = re.compile(r'(\d+):(\d\d):(\d\d)$')
+
+_RATE_RE = re.compile(r'(\d+)([kKMG]?)$')
+
+_RATE_UNITS = {'': 1, 'k': 1000, 'K': 1000, 'M': 1000 ** 2, 'G': 1000 ** 3}
+
+
+def canonical_value(value):
+    """Return an attribute value in a form equal for its RouterOS spellings.
+
+    Booleans (``yes``/``true``, ``no``/``false``), durations (``90s``,
+    ``1m30s``, ``00:01:30``) and rates (``20M``, ``20000000``) are compared
+    by their meaning, anything else as is.
+    """
+    if value is None:
+        return None
+    if value in ('yes', 'true'):
+        return ('boolean', True)
+    if value in ('no', 'false'):
+        return ('boolean', False)
+    match = _RATE_RE.match(value)
+    if match:
+        return int(match[1]) * _RATE_UNITS[match[2]]
+    match = _CLOCK_RE.match(value)
+    if match:
+        return ('duration', (int(match[1]) * 3600 + int(match[2]) * 60 + int(match[3])) * 1000)
+    match = _DURATION_RE.match(value)
+    if value and match:
+        return ('duration', sum(int(n) * unit for n, unit in zip(match.groups(), _DURATION_UNITS)
+                                if n is not None))
+    return value
+
+
+_SCRIPT_RESULT_RE = re.compile(r'inkirinet applied=(\d+) failed=(\d+)$')
+
+_LEASE_ID_RE = re.compile(r'\*[0-9A-F]+$')
+
+_ATTRIBUTE_RE = re.compile(r'[a-z][a-z0-9-]*$')
+
+
+def quote_script_string(value):
+    """Return ``value`` as a RouterOS script string literal."""
+    value = (str(value).replace('\\', '\\\\')
+                       .replace('"', '\\"')
+                       .replace('$', '\\$')
+                       .replace('?', '\\?')
+                       .replace('\n', '\\n')
+                       .replace('\r', '\\r')
+                       .replace('\t', '\\t'))
+    return f'"{value}"'
+
+
+def render_lease_script(operations, name):
+    """Render lease operations as a RouterOS script.
+
+    Each operation runs on its own, a failure is counted and the rest still
+    run.  At the end the script writes the counts to its own comment, as
+    ``inkirinet applied=N failed=M``.
+    """
+    lines = [':local applied 0', ':local failed 0']
+    for action, lease_id, attrs in operations:
+        words = [f'/ip dhcp-server lease {action}']
+        if lease_id is not None:
+            if not _LEASE_ID_RE.match(lease_id):
+                raise ValueError(f"Invalid lease id: '{lease_id}'.")
+            words.append(lease_id)
+        for key, value in attrs.items():
+            key = key.replace('_', '-')
+            if not _ATTRIBUTE_RE.match(key):
+                raise ValueError(f"Invalid lease attribute: '{key}'.")
+            words.append(f'{key}={quote_script_string(value)}')
+        lines.append(f":do {{ {' '.join(words)}; :set applied ($applied + 1) }} "
+                     f"on-error={{ :set failed ($failed + 1) }}")
+    lines.append(f'/system script set [find name={quote_script_string(name)}] '
+                 f'comment=("inkirinet applied=" . $applied . " failed=" . $failed)')
+    return '\n'.join(lines) + '\n'
+
+
+class AsyncMikrotik:
+    """The subset of :class:`Mikrotik` operations available on asyncio."""
+
+    def __init__(self, api):
+        self.api = api
+
+    async def get_mac_address_by_dynamic_ip(self, ip_address):
+        """Find the dynamic lease that has :param:`ip_address` as the active address."""
+        return Mikrotik._parse_mac_address_reply(
+            await self.api.talk(Mikrotik._mac_address_by_dynamic_ip_query(ip_address)))
+
+
 class ApiRos:
     """Routeros API."""
 
-    def __init__(self, sk):
+    def __init__(self, sk, timeout=None, tracer=None):
         self.sk = sk
         self.currenttag = 0
         self._read_buffer = b''
+        # A :class:`inkirinet.wiretrace.WireTracer`, or None not to trace.
+        self.tracer = tracer
+        # Seconds to wait for each read or write, and the time.monotonic()
+        # all of them have to be done by.
+        self.timeout = timeout
+        self.deadline = None
 
     def login(self, username, pwd):
         for repl, attrs in self.talk(["/login", "=name=" + username,
@@ -183,31 +799,36 @@ class ApiRos:
         return True
 
     def talk(self, words):
-        if self.writeSentence(words) == 0: return
-        r = []
-        while 1:
-            i = self.readSentence()
-            if len(i) == 0:
-                continue
-            reply = i[0]
-            attrs = {}
-            for w in i[1:]:
-                j = w.find('=', 1)
-                if (j == -1):
-                    attrs[w] = ''
-                else:
-                    attrs[w[:j].strip('=')] = w[j + 1:]
-            r.append((reply, attrs))
-            if reply == '!done':
-                break
-        return r
+        return [parse_sentence(i) for i in self.talk_sentences(words)]
+
+    def talk_sentences(self, words):
+        """Like :meth:`talk`, but yield the words of each reply as it arrives."""
+        trace = None if self.tracer is None else self.tracer.start(words)
+        try:
+            if self.writeSentence(words) == 0: return
+            while 1:
+                i = self.readSentence()
+                if len(i) == 0:
+                    continue
+                if trace is not None:
+                    trace.reply(i)
+                yield i
+                if i[0] == '!done':
+                    break
+        finally:
+            if trace is not None:
+                trace.finish()
 
     def writeSentence(self, words):
-        ret = 0
-        for w in words:
-            self.writeWord(w)
-            ret += 1
-        self.writeWord('')
+        ret = len(words)
+        # A single send per sentence, not a few per word.
+        self.settimeout()
+        try:
+            self.sk.sendall(encode_sentence(words))
+        except socket.timeout:
+            raise self.timeout_error() from None
+        except OSError as error:
+            raise self.connection_error(error) from error
         return ret
 
     def readSentence(self):
@@ -218,14 +839,11 @@ class ApiRos:
             r.append(w)
 
     def writeWord(self, w):
-        logger.debug(("<<< " + w))
         self.writeLen(len(w))
         self.writeStr(w)
 
     def readWord(self):
-        ret = self.readStr(self.readLen())
-        logger.debug((">>> " + ret))
-        return ret
+        return self.readStr(self.readLen())
 
     def writeLen(self, l):
         if l < 0x80:
@@ -254,88 +872,434 @@ class ApiRos:
             self.writeByte((l & 0xFF).to_bytes(1, sys.byteorder))
 
     def readLen(self):
-        c = ord(self.readStr(1))
+        c = self.readByte()
         # print (">rl> %i" % c)
         if (c & 0x80) == 0x00:
             pass
         elif (c & 0xC0) == 0x80:
             c &= ~0xC0
             c <<= 8
-            c += ord(self.readStr(1))
+            c += self.readByte()
         elif (c & 0xE0) == 0xC0:
             c &= ~0xE0
             c <<= 8
-            c += ord(self.readStr(1))
+            c += self.readByte()
             c <<= 8
-            c += ord(self.readStr(1))
+            c += self.readByte()
         elif (c & 0xF0) == 0xE0:
             c &= ~0xF0
             c <<= 8
-            c += ord(self.readStr(1))
+            c += self.readByte()
             c <<= 8
-            c += ord(self.readStr(1))
+            c += self.readByte()
             c <<= 8
-            c += ord(self.readStr(1))
+            c += self.readByte()
         elif (c & 0xF8) == 0xF0:
-            c = ord(self.readStr(1))
+            c = self.readByte()
             c <<= 8
-            c += ord(self.readStr(1))
+            c += self.readByte()
             c <<= 8
-            c += ord(self.readStr(1))
+            c += self.readByte()
             c <<= 8
-            c += ord(self.readStr(1))
+            c += self.readByte()
         return c
 
     def writeStr(self, str):
         n = 0
         while n < len(str):
             r = self.sk.send(bytes(str[n:], 'UTF-8'))
-            if r == 0: raise RuntimeError("connection closed by remote end")
+            if r == 0: raise self.connection_error()
             n += r
 
     def writeByte(self, str):
         n = 0
         while n < len(str):
             r = self.sk.send(str[n:])
-            if r == 0: raise RuntimeError("connection closed by remote end")
+            if r == 0: raise self.connection_error()
             n += r
 
+    def readByte(self):
+        # Not through readStr, from 0x80 on a length's first byte isn't
+        # valid UTF-8, e.g. for words of 128 bytes or more.
+        return self._read(1)[0]
+
     def readStr(self, length):
+        return self._read(length).decode(sys.stdout.encoding, "replace")
+
+    def _read(self, length):
         while len(self._read_buffer) < length:
-            s = self.sk.recv(4096)
-            if s == b'': raise RuntimeError("connection closed by remote end")
+            self.settimeout()
+            try:
+                s = self.sk.recv(4096)
+            except socket.timeout:
+                raise self.timeout_error() from None
+            except OSError as error:
+                raise self.connection_error(error) from error
+            if s == b'': raise self.connection_error()
             self._read_buffer += s
         s = self._read_buffer[:length]
         self._read_buffer = self._read_buffer[length:]
-        return s.decode(sys.stdout.encoding, "replace")
+        return s
+
+    def settimeout(self):
+        """Set the socket's timeout for the next read or write."""
+        if self.timeout is None and self.deadline is None:
+            return
+        timeout = self.timeout
+        if self.deadline is not None:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                raise self.timeout_error()
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            self.sk.settimeout(timeout)
+        except OSError as error:
+            raise self.connection_error(error) from error
+
+    def timeout_error(self):
+        # A late reply would be read as the next command's, discard the
+        # connection.
+        self.sk.close()
+        return RouterOSTimeoutError("Timed out waiting for the RouterOS API.")
+
+    def connection_error(self, error=None):
+        self.sk.close()
+        return RouterOSConnectionError(f"Lost the connection to the RouterOS API: "
+                                       f"{error or 'closed by remote end'}.")
 
 
-def open_socket(dst, port, *, secure=False):
-    skt = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    if secure:
-        s = ssl.wrap_socket(skt, ssl_version=ssl.PROTOCOL_TLSv1_2,
-                            ciphers="ADH-AES128-SHA256")  # ADH-AES128-SHA256
-    else:
-        s = skt
-    s.connect((dst, port))
+class AsyncApiRos:
+    """Routeros API on top of asyncio streams."""
+
+    def __init__(self, reader, writer, timeout=None, tracer=None):
+        self.reader = reader
+        self.writer = writer
+        self.tracer = tracer
+        # Seconds to wait for each command's reply.
+        self.timeout = timeout
+
+    async def login(self, username, pwd):
+        for repl, attrs in await self.talk(["/login", "=name=" + username,
+                                            "=password=" + pwd]):
+            if repl == '!trap':
+                return False
+            elif '=ret' in attrs.keys():
+                chal = binascii.unhexlify((attrs['=ret']).encode(sys.stdout.encoding))
+                md = hashlib.md5()
+                md.update(b'\x00')
+                md.update(pwd.encode(sys.stdout.encoding))
+                md.update(chal)
+                for repl2, attrs2 in await self.talk(["/login", "=name=" + username,
+                                                      "=response=00" + binascii.hexlify(
+                                                          md.digest()).decode(sys.stdout.encoding)]):
+                    if repl2 == '!trap':
+                        return False
+        return True
+
+    async def talk(self, words):
+        if self.timeout is None:
+            return await self._talk(words)
+        try:
+            return await asyncio.wait_for(self._talk(words), self.timeout)
+        except asyncio.TimeoutError:
+            self.writer.close()
+            raise RouterOSTimeoutError("Timed out waiting for the RouterOS API.") from None
+
+    async def _talk(self, words):
+        try:
+            return await self._talk_sentences(words)
+        except asyncio.IncompleteReadError as error:
+            self.writer.close()
+            raise RouterOSConnectionError("Lost the connection to the RouterOS API: "
+                                          "closed by remote end.") from error
+        except OSError as error:
+            self.writer.close()
+            raise RouterOSConnectionError(f"Lost the connection to the RouterOS API: "
+                                          f"{error}.") from error
+
+    async def _talk_sentences(self, words):
+        trace = None if self.tracer is None else self.tracer.start(words)
+        try:
+            self.writer.write(encode_sentence(words))
+            await self.writer.drain()
+            r = []
+            while True:
+                sentence = await self.readSentence()
+                if not sentence:
+                    continue
+                if trace is not None:
+                    trace.reply(sentence)
+                reply, attrs = parse_sentence(sentence)
+                r.append((reply, attrs))
+                if reply == '!done':
+                    break
+            return r
+        finally:
+            if trace is not None:
+                trace.finish()
+
+    async def readSentence(self):
+        r = []
+        while True:
+            w = await self.readWord()
+            if w == '':
+                return r
+            r.append(w)
+
+    async def readWord(self):
+        data = await self.reader.readexactly(await self.readLen())
+        return data.decode(sys.stdout.encoding, "replace")
+
+    async def readLen(self):
+        c = (await self.reader.readexactly(1))[0]
+        if (c & 0x80) == 0x00:
+            return c
+        elif (c & 0xC0) == 0x80:
+            extra, c = 1, c & ~0xC0
+        elif (c & 0xE0) == 0xC0:
+            extra, c = 2, c & ~0xE0
+        elif (c & 0xF0) == 0xE0:
+            extra, c = 3, c & ~0xF0
+        else:
+            extra, c = 4, 0
+        return int.from_bytes(bytes([c]) + await self.reader.readexactly(extra), 'big')
+
+
+def encode_length(l):
+    """Encode a word length as in the RouterOS API protocol."""
+    if l < 0x80:
+        return l.to_bytes(1, 'big')
+    elif l < 0x4000:
+        return (l | 0x8000).to_bytes(2, 'big')
+    elif l < 0x200000:
+        return (l | 0xC00000).to_bytes(3, 'big')
+    elif l < 0x10000000:
+        return (l | 0xE0000000).to_bytes(4, 'big')
+    return b'\xf0' + l.to_bytes(4, 'big')
+
+
+def encode_sentence(words):
+    """Encode a list of words as an API sentence (including its terminator)."""
+    ret = bytearray()
+    for w in words:
+        w = w.encode('UTF-8')
+        ret += encode_length(len(w))
+        ret += w
+    ret += b'\x00'
+    return bytes(ret)
+
+
+def parse_sentence(sentence):
+    """Return the reply word and the attributes of a received sentence."""
+    attrs = {}
+    for w in sentence[1:]:
+        j = w.find('=', 1)
+        if (j == -1):
+            attrs[w] = ''
+        else:
+            attrs[w[:j].strip('=')] = w[j + 1:]
+    return sentence[0], attrs
+
+
+# RouterOS's API-SSL without a certificate only offers anonymous DH.
+ANONYMOUS_CIPHERS = 'ADH-AES128-SHA256:@SECLEVEL=0'
+
+# TLS contexts by settings, and the last TLS session of each router, to
+# resume it instead of a full handshake on each connection.
+_tls_contexts = {}
+_tls_sessions = {}
+
+# The TLS session to resume in the asyncio connection being opened, asyncio
+# doesn't pass one to SSLContext.wrap_bio().
+_tls_session_to_resume = contextvars.ContextVar('_tls_session_to_resume', default=None)
+
+
+class _TLSContext(ssl.SSLContext):
+    """A TLS context resuming :data:`_tls_session_to_resume` in asyncio."""
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None,
+                 session=None):
+        if session is None:
+            session = _tls_session_to_resume.get()
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+
+def tls_context(*, cafile=None, fingerprint=None):
+    """Return the TLS context to connect to a router.
+
+    :param cafile: Verify the router's certificate (and host name) against
+                   these CA certificates.
+    :param fingerprint: Pin the router's certificate to this SHA-256
+                        fingerprint (hex, colons allowed), e.g. a self-signed
+                        certificate.  Checked by :func:`check_fingerprint`.
+
+    Without either, the router has no certificate and the connection is
+    encrypted, but not authenticated (anonymous Diffie-Hellman).
+    """
+    key = (cafile, fingerprint)
+    context = _tls_contexts.get(key)
+    if context is None:
+        context = _TLSContext(ssl.PROTOCOL_TLS_CLIENT)
+        if cafile is not None:
+            context.load_verify_locations(cafile)
+        else:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            if fingerprint is None:
+                # There are no anonymous ciphers in TLS 1.3.
+                context.maximum_version = ssl.TLSVersion.TLSv1_2
+                context.set_ciphers(ANONYMOUS_CIPHERS)
+        context = _tls_contexts.setdefault(key, context)
+    return context
+
+
+def check_fingerprint(ssl_object, fingerprint):
+    """Raise if the peer's certificate isn't the one pinned."""
+    certificate = ssl_object.getpeercert(binary_form=True)
+    expected = fingerprint.replace(':', '').lower()
+    if certificate is None or hashlib.sha256(certificate).hexdigest() != expected:
+        raise ssl.SSLCertVerificationError(
+            f"RouterOS API certificate doesn't match the pinned fingerprint: "
+            f"{fingerprint}")
+
+
+def set_socket_options(skt):
+    # Sentences are small and each one waits for a reply, don't delay them
+    # (Nagle) and notice dead routers on idle connections.
+    skt.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    skt.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+
+def open_socket(dst, port, *, secure=False, cafile=None, fingerprint=None, timeout=None):
+    """Connect to a router.
+
+    :param timeout: Seconds to wait for the connection and the TLS handshake
+                    (each), and then for every read or write.
+    :raise RouterOSTimeoutError: If the router takes longer.
+    :raise RouterOSConnectionError: If the router can't be reached.
+    """
+    try:
+        skt = socket.create_connection((dst, port), timeout)
+    except socket.timeout:
+        raise RouterOSTimeoutError(f"Timed out connecting to RouterOS API at "
+                                   f"{dst}:{port}.") from None
+    except OSError as error:
+        raise RouterOSConnectionError(f"Can't connect to RouterOS API at "
+                                      f"{dst}:{port}: {error}.") from error
+    set_socket_options(skt)
+    if not secure:
+        return skt
+    try:
+        s = tls_context(cafile=cafile, fingerprint=fingerprint).wrap_socket(
+            skt, server_hostname=dst, session=_tls_sessions.get((dst, port)))
+        if fingerprint is not None:
+            check_fingerprint(s, fingerprint)
+    except socket.timeout:
+        skt.close()
+        raise RouterOSTimeoutError(f"Timed out in the TLS handshake with RouterOS "
+                                   f"API at {dst}:{port}.") from None
+    except OSError as error:
+        skt.close()
+        raise RouterOSConnectionError(f"TLS handshake with RouterOS API at "
+                                      f"{dst}:{port} failed: {error}.") from error
+    except BaseException:
+        skt.close()
+        raise
+    logger.debug('TLS connection to %s:%s: cipher=%s session_reused=%s',
+                 dst, port, s.cipher(), s.session_reused)
     return s
 
 
+def save_tls_session(host, port, ssl_object):
+    # Once the router answered, with TLS 1.3 the session (ticket) only
+    # arrives after the handshake.
+    if ssl_object is not None:
+        _tls_sessions[(host, port)] = ssl_object.session
+
+
 @contextlib.contextmanager
-def connect(host, port, username, password, *, disable_ssl=False):
+def connect(host, port, username, password, *, disable_ssl=False, ssl_cafile=None,
+            ssl_fingerprint=None, timeout=None, tracer=None, lease_cache=None,
+            queue_mode=False):
+    """Connect and login to a router, yield a :class:`Mikrotik`.
+
+    :param timeout: Seconds the router has to accept the connection, to
+                    login and then to answer each read or write.  Use
+                    :meth:`Mikrotik.deadline` to limit whole operations.
+    :param tracer: A :class:`inkirinet.wiretrace.WireTracer` to trace the
+                   commands, off by default.
+    :raise RouterOSTimeoutError: If the router takes longer, the connection is
+                                 closed then.
+    :raise RouterOSConnectionError: If the router can't be reached or the
+                                    connection is lost.
+    """
     secure = not disable_ssl
-    sock = open_socket(host, port, secure=secure)
-    api = ApiRos(sock)
+    sock = open_socket(host, port, secure=secure, cafile=ssl_cafile,
+                       fingerprint=ssl_fingerprint, timeout=timeout)
+    api = ApiRos(sock, timeout=timeout, tracer=tracer)
     try:
+        if timeout is not None:
+            api.deadline = time.monotonic() + timeout
         if not api.login(username, password):
-            raise Exception(f"Connected to RouterOS API (Mikrotik), but "
-                            "authentication failed: username='{username}' "
-                            "password='{len(password) * '*'}'.")
-        yield Mikrotik(api)
+            raise RouterOSError(f"Connected to RouterOS API (Mikrotik), but "
+                                f"authentication failed: username='{username}' "
+                                f"password='{len(password) * '*'}'.")
+        api.deadline = None
+        save_tls_session(host, port, sock if secure else None)
+        yield Mikrotik(api, lease_cache=lease_cache, queue_mode=queue_mode)
     finally:
         sock.close()
 
 
+@contextlib.asynccontextmanager
+async def async_connect(host, port, username, password, *, disable_ssl=False,
+                        ssl_cafile=None, ssl_fingerprint=None, timeout=None, tracer=None):
+    """Like :func:`connect`, but yields an :class:`AsyncMikrotik`.
+
+    With a ``timeout``, each command (instead of each read) has to be
+    answered in time.
+    """
+    context = None
+    if not disable_ssl:
+        context = tls_context(cafile=ssl_cafile, fingerprint=ssl_fingerprint)
+    token = _tls_session_to_resume.set(_tls_sessions.get((host, port)) if context else None)
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=context,
+                                    server_hostname=host if context else None),
+            timeout)
+    except asyncio.TimeoutError:
+        raise RouterOSTimeoutError(f"Timed out connecting to RouterOS API at "
+                                   f"{host}:{port}.") from None
+    except OSError as error:
+        raise RouterOSConnectionError(f"Can't connect to RouterOS API at "
+                                      f"{host}:{port}: {error}.") from error
+    finally:
+        _tls_session_to_resume.reset(token)
+    try:
+        # asyncio already disables Nagle on TCP sockets.
+        set_socket_options(writer.get_extra_info('socket'))
+        ssl_object = writer.get_extra_info('ssl_object')
+        if ssl_fingerprint is not None and ssl_object is not None:
+            try:
+                check_fingerprint(ssl_object, ssl_fingerprint)
+            except ssl.SSLError as error:
+                raise RouterOSConnectionError(f"TLS handshake with RouterOS API at "
+                                              f"{host}:{port} failed: {error}.") from error
+        if ssl_object is not None:
+            logger.debug('TLS connection to %s:%s: cipher=%s session_reused=%s',
+                         host, port, ssl_object.cipher(), ssl_object.session_reused)
+        api = AsyncApiRos(reader, writer, timeout=timeout, tracer=tracer)
+        if not await api.login(username, password):
+            raise RouterOSError(f"Connected to RouterOS API (Mikrotik), but "
+                                f"authentication failed: username='{username}' "
+                                f"password='{len(password) * '*'}'.")
+        save_tls_session(host, port, ssl_object)
+        yield AsyncMikrotik(api)
+    finally:
+        writer.close()
+
+
 def parse_args():
     import argparse
 
@@ -0,0 +1,118 @@
+import logging
+import random
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """A token bucket used to keep requests within an API quota.
+
+    Tokens are added at ``rate`` tokens per second up to ``capacity``.  Taking
+    a token from an empty bucket is allowed, but the caller is told how long
+    it has to wait before the request fits in the budget.
+    """
+
+    def __init__(self, rate, capacity, *, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+
+    def take(self):
+        """Take one token and return the seconds to wait before using it."""
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class Backoff:
+    """Exponential backoff with full jitter."""
+
+    def __init__(self, base=1.0, cap=300.0, *, random=random.random):
+        self.base = base
+        self.cap = cap
+        self.random = random
+        self.attempts = 0
+
+    def next(self):
+        """Return the delay before the next attempt."""
+        ceiling = min(self.cap, self.base * 2 ** self.attempts)
+        self.attempts += 1
+        return ceiling * self.random()
+
+    def reset(self):
+        self.attempts = 0
+
+
+class AdaptiveInterval:
+    """A polling interval that shortens after changes and grows when idle."""
+
+    def __init__(self, minimum, maximum, factor=2.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.current = minimum
+
+    def update(self, changed):
+        """Update and return the interval given if the last poll had changes."""
+        if changed:
+            self.current = self.minimum
+        else:
+            self.current = min(self.maximum, self.current * self.factor)
+        return self.current
+
+
+class Poller:
+    """Call ``poll`` repeatedly within a request budget.
+
+    :param poll: A callable returning a truthy value when it found changes.
+    :param is_retryable: A callable telling if an exception raised by
+                         ``poll`` is transient (e.g. rate limited), those are
+                         retried after a backoff, all others are re-raised.
+    :param retry_after: An optional callable returning the delay (in seconds)
+                        requested by the server for a retryable exception, or
+                        ``None``.
+    """
+
+    logger = logger.getChild('Poller')
+
+    def __init__(self, poll, *, budget, interval, backoff, is_retryable,
+                 retry_after=None, sleep=time.sleep):
+        self.poll = poll
+        self.budget = budget
+        self.interval = interval
+        self.backoff = backoff
+        self.is_retryable = is_retryable
+        self.retry_after = retry_after
+        self.sleep = sleep
+
+    def run(self, iterations=None):
+        """Poll forever, or ``iterations`` times."""
+        count = 0
+        while iterations is None or count < iterations:
+            count += 1
+            wait = self.budget.take()
+            if wait:
+                self.logger.info('Request budget exhausted, waiting %.1fs.', wait)
+                self.sleep(wait)
+            try:
+                changed = self.poll()
+            except Exception as error:
+                if not self.is_retryable(error):
+                    raise
+                delay = self.backoff.next()
+                if self.retry_after is not None:
+                    delay = max(delay, self.retry_after(error) or 0)
+                self.logger.warning('Poll failed, retrying in %.1fs: %s', delay, error)
+                self.sleep(delay)
+                continue
+            self.backoff.reset()
+            self.sleep(self.interval.update(changed))
@@ -1,41 +1,106 @@
+import collections
 import datetime
+import functools
 import logging
+import re
 
+import google.auth.credentials
+import google.auth.exceptions
+import google_auth_httplib2
+import httplib2
 from google.oauth2 import service_account
 from googleapiclient import discovery
+from googleapiclient import errors
+
+from . import macaddress
 
 
 logger = logging.getLogger(__name__)
 
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
+
+# Read and write, to write back contract statuses.
+WRITE_SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Rate limited (429) and server side errors worth retrying.
+RETRYABLE_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+def is_retryable(error):
+    """Tell if an error raised by the Sheets API is transient."""
+    if isinstance(error, errors.HttpError):
+        return error.resp.status in RETRYABLE_STATUSES
+    # Network errors, and DNS failures or token refreshes failing with them.
+    return isinstance(error, (OSError,
+                              httplib2.ServerNotFoundError,
+                              google.auth.exceptions.TransportError))
+
+
+def retry_after(error):
+    """Return the delay in seconds requested by a Retry-After header, if any."""
+    if isinstance(error, errors.HttpError):
+        try:
+            return float(error.resp.get('retry-after'))
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def build_service(key_file, writable=False):
+    """Build (once per process) the Sheets API resource for a service account.
+
+    The returned resource shares a single authorized HTTP transport, so the
+    TLS connection is kept alive and the access token is only refreshed when
+    it expires.  The discovery document is the one bundled with the client
+    library, building the resource doesn't fetch it.
+
+    :param writable: Request the read-write scope instead of read only.
+    """
+    credentials = service_account.Credentials.from_service_account_file(key_file)
+    credentials = google.auth.credentials.with_scopes_if_required(
+        credentials, WRITE_SCOPES if writable else SCOPES)
+    http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+    return discovery.build('sheets',
+                           'v4',
+                           http=http,
+                           cache_discovery=False,
+                           static_discovery=True) \
+                    .spreadsheets()
+
 
 class Spreadsheet:
     """A wrapper around Google Spreadsheet APIs."""
 
     logger = logger.getChild('Spreadsheet')
 
-    def __init__(self, key_file, spreadsheet_id):
-        credentials = service_account.Credentials.from_service_account_file(key_file)
-        self.sheets = discovery.build('sheets',
-                                      'v4',
-                                      credentials=credentials,
-                                      cache_discovery=False) \
-                               .spreadsheets()
+    def __init__(self, key_file, spreadsheet_id, status_column='S', writable=False):
+        self.sheets = build_service(key_file, writable)
         self.spreadsheet_id = spreadsheet_id
+        self.status_column = status_column
+        self.errors = []
+        self.statuses = {}
 
     def read_all(self):
+        """Read and parse all contracts from the spreadsheet.
+
+        Rows that could not be parsed are left out and reported in
+        :attr:`errors`.
+
+        :return: A dictionary of contracts, by e-mail.
+        """
         result = self.sheets \
                      .values() \
-                     .get(spreadsheetId=self.spreadsheet_id, range='A:R') \
+                     .get(spreadsheetId=self.spreadsheet_id,
+                          range=f'A:{self.status_column}') \
                      .execute()
-        contracts = []
+        rows = result.get('values', [])[1:]
         # Ignore first row: header.
-        for row in result['values'][1:]:
-            try:
-                contract = self._create_contract_from_row(row)
-            except ValueError:
-                logging.error("Invalid contract row, ignoring: %s", row)
-                continue
-            contracts.append(contract)
+        contracts, errors = parse_rows(rows)
+        status_index = column_index(self.status_column)
+        self.statuses = {number: row[status_index]
+                         for number, row in enumerate(rows, FIRST_ROW)
+                         if len(row) > status_index and row[status_index]}
         ret = {}
         for contract in sorted(contracts, key=lambda c: c.created_at):
             if contract.email in ret:
@@ -43,54 +108,200 @@ class Spreadsheet:
                              "original=%s duplicate=%s",
                              repr(ret[contract.email]),
                              repr(contract))
+                errors.append(RowError(contract.row, 'email',
+                                       f"Duplicated e-mail, first used at row "
+                                       f"{ret[contract.email].row}."))
                 continue
             ret[contract.email] = contract
+        self.errors = sorted(errors)
         return ret
 
-    @staticmethod
-    def _create_contract_from_row(row):
-        if len(row) < 18:
-            row.extend([''] * (18 - len(row)))
+    def write_statuses(self, statuses):
+        """Write the status column for the rows whose status changed.
+
+        Rows are diffed against the statuses read by :meth:`read_all` (or
+        written by the last call), consecutive changed rows are written as a
+        single range and all ranges are sent in one ``batchUpdate`` request.
+        The spreadsheet must be :attr:`writable`.
+
+        :param statuses: A dictionary of status strings by row number, the
+                         statuses of the other rows (e.g. of contracts no
+                         longer in the spreadsheet) are cleared.
+        :return: The number of cells written.
+        """
+        statuses = {**dict.fromkeys(self.statuses, ''), **statuses}
+        changed = sorted(row for row, status in statuses.items()
+                         if self.statuses.get(row, '') != status)
+        if not changed:
+            return 0
+        data = []
+        start = previous = changed[0]
+        for row in changed[1:] + [None]:
+            if row != previous + 1:
+                data.append({
+                    'range': f'{self.status_column}{start}:{self.status_column}{previous}',
+                    'values': [[statuses[r]] for r in range(start, previous + 1)],
+                })
+                start = row
+            previous = row
+        self.sheets \
+            .values() \
+            .batchUpdate(spreadsheetId=self.spreadsheet_id,
+                         body={'valueInputOption': 'RAW', 'data': data}) \
+            .execute()
+        for row in changed:
+            if statuses[row]:
+                self.statuses[row] = statuses[row]
+            else:
+                del self.statuses[row]
+        return len(changed)
+
+
+def column_index(column):
+    """Convert a column letter (e.g. 'A' or 'AB') to a 0-based index."""
+    index = 0
+    for letter in column.upper():
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
 
-        plan_type = row[1].split(' ', 1)[0].upper().rstrip('PS')
 
-        # The plan "Mais velocidade (ik$150 + ik$10 por cada 1Mbps)"
-        # is converted to "MAI" then mapped into "50MB", all the other
-        # plans start with the MB and are parsed accordingly.
-        if plan_type == 'MAI':
-            plan_type = '50MB'
+# Spreadsheet columns used for the contracts.
 
-        max_devices = int(row[2].strip().split(' ', 1)[0])
+COLUMN_CREATED_AT = 0
+COLUMN_PLAN_TYPE = 1
+COLUMN_MAX_DEVICES = 2
+COLUMN_NAME = 4
+COLUMN_EMAIL = 6
+COLUMN_DEVICES = 8
 
-        name = row[4].strip().title()
+ROW_LENGTH = 18
 
-        email = row[6].lower()
+# The first row with contracts in the spreadsheet (the first is the header).
+FIRST_ROW = 2
 
-        # Plans are marked as "active" when being imported.
-        active = True
+# Force UTC-3 given the database was created in Brazilian timezone.
+SHEET_TIMEZONE = datetime.timezone(datetime.timedelta(hours=-3))
 
-        # Force UTC-3 given the database was created in Brazilian timezone.
-        created_at = datetime.datetime.strptime(row[0] + ' -0300', '%d/%m/%Y %H:%M:%S %z')
+_CREATED_AT_RE = re.compile(r'\s*(\d{1,2})/(\d{1,2})/(\d{4}) (\d{1,2}):(\d{2}):(\d{2})\s*$')
 
-        devices = { mac.strip().upper().split(' - ')[0]
-                    for mac in row[8].split('\n')
-                    if mac }
+# The plan "Mais velocidade (ik$150 + ik$10 por cada 1Mbps)" is mapped into
+# "50MB", all the other plans start with the speed, e.g. "10Mbps por ...".
+_PLAN_TYPE_RE = re.compile(r'\s*(?:(\d+)MBP?S?|(MAIS))\b', re.IGNORECASE)
 
-        return Contract(email,
-                        name,
-                        plan_type,
-                        active,
-                        created_at,
-                        max_devices,
-                        devices)
+_MAX_DEVICES_RE = re.compile(r'\s*(\d+)')
+
+# Devices are listed one per line, optionally followed by a description,
+# e.g. "aa:bb:cc:dd:ee:ff - My phone".
+_DEVICE_RE = re.compile(r'\s*((?:[0-9A-F]{2}[:-]){5}[0-9A-F]{2})(?:\s|$)', re.IGNORECASE)
+
+
+class RowError(collections.namedtuple('RowError', ('row', 'field', 'reason'))):
+    """A problem found in a spreadsheet row, :attr:`row` is 1-based."""
+
+    def __str__(self):
+        return f"row {self.row}: {self.field}: {self.reason}"
+
+
+def parse_row(number, row):
+    """Parse a single contract row.
+
+    :param number: The row number in the spreadsheet.
+    :return: A tuple with the parsed :class:`Contract` (``None`` if the row is
+             invalid) and a list of :class:`RowError`.
+    """
+    if len(row) < ROW_LENGTH:
+        row = tuple(row) + ('',) * (ROW_LENGTH - len(row))
+    errors = []
+
+    match = _PLAN_TYPE_RE.match(row[COLUMN_PLAN_TYPE])
+    plan_type = None
+    if match is None:
+        errors.append(RowError(number, 'plan_type',
+                               f"Unknown internet plan: '{row[COLUMN_PLAN_TYPE]}'."))
+    else:
+        plan_type = f'{match[1]}MB' if match[1] else '50MB'
+        if plan_type not in Contract.PLAN_TYPES:
+            errors.append(RowError(number, 'plan_type',
+                                   f"Invalid internet plan: '{plan_type}'."))
+
+    match = _MAX_DEVICES_RE.match(row[COLUMN_MAX_DEVICES])
+    max_devices = None
+    if match is None:
+        errors.append(RowError(number, 'max_devices',
+                               f"Invalid number of devices: '{row[COLUMN_MAX_DEVICES]}'."))
+    else:
+        max_devices = int(match[1])
+
+    name = row[COLUMN_NAME].strip().title()
+
+    email = row[COLUMN_EMAIL].strip().lower()
+    if not email:
+        errors.append(RowError(number, 'email', "Missing e-mail."))
+
+    match = _CREATED_AT_RE.match(row[COLUMN_CREATED_AT])
+    created_at = None
+    if match is not None:
+        day, month, year, hour, minute, second = map(int, match.groups())
+        try:
+            created_at = datetime.datetime(year, month, day, hour, minute, second,
+                                           tzinfo=SHEET_TIMEZONE)
+        except ValueError:
+            pass
+    if created_at is None:
+        errors.append(RowError(number, 'created_at',
+                               f"Invalid date, expected 'dd/mm/yyyy HH:MM:SS': "
+                               f"'{row[COLUMN_CREATED_AT]}'."))
+
+    devices = set()
+    for line in row[COLUMN_DEVICES].split('\n'):
+        if not line.strip():
+            continue
+        match = _DEVICE_RE.match(line)
+        if match is None:
+            # A bad MAC address doesn't invalidate the whole contract.
+            errors.append(RowError(number, 'devices',
+                                   f"Invalid MAC address, ignoring: '{line.strip()}'."))
+        else:
+            devices.add(macaddress.normalize(match[1]))
+
+    if any(error.field != 'devices' for error in errors):
+        return None, errors
+
+    # Plans are marked as "active" when being imported.
+    return Contract(email,
+                    name,
+                    plan_type,
+                    True,
+                    created_at,
+                    max_devices,
+                    devices,
+                    row=number), errors
+
+
+def parse_rows(rows, *, first=FIRST_ROW):
+    """Parse contract rows.
+
+    :param first: The spreadsheet row number of the first row in ``rows``.
+    :return: A tuple with the list of valid contracts and the list of
+             :class:`RowError` found.
+    """
+    contracts = []
+    errors = []
+    for number, row in enumerate(rows, first):
+        contract, row_errors = parse_row(number, row)
+        if contract is not None:
+            contracts.append(contract)
+        errors.extend(row_errors)
+    return contracts, errors
 
 
 class Contract:
     """A model class representing a single plan contract for InkiriNet."""
 
-    PLAN_TYPES = ('2MB', '4MB', '10MB', '10MB+')
+    PLAN_TYPES = ('2MB', '4MB', '10MB', '10MB+', '50MB')
 
-    def __init__(self, email, name, plan_type, active, created_at, max_devices, devices):
+    def __init__(self, email, name, plan_type, active, created_at, max_devices, devices,
+                 row=None):
         self.name = name
         if plan_type not in self.PLAN_TYPES:
             raise ValueError(f"Invalid internet plan: '{plan_type}'.")
@@ -104,6 +315,7 @@ class Contract:
         self.active = active
         self.max_devices = max_devices
         self.devices = devices
+        self.row = row
 
     def __str__(self):
         return f"{self.email}: {self.devices}"
@@ -0,0 +1,103 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+
+class _Abandoned(Exception):
+    """The call was given up (e.g. cancelled), another caller has to run it."""
+
+
+class Group:
+    """Coalesce concurrent calls sharing a key into a single call.
+
+    Calls made while another one with the same key is running wait for it and
+    share its result (or exception).  Results other than ``None`` are also
+    kept for ``cooldown`` seconds, answering retries without calling again.
+    If the running call is cancelled, one of the waiting calls runs instead.
+    Threads and coroutines (in any event loop) can share a group.
+
+    Calls are only coalesced within a process.
+    """
+
+    def __init__(self, cooldown=0.0, *, clock=time.monotonic):
+        self.cooldown = cooldown
+        self.clock = clock
+        self._lock = threading.Lock()
+        # key -> (future, expires_at), expires_at is None while running.
+        self._calls = {}
+
+    def clear(self):
+        """Forget the results kept for the cooldown."""
+        with self._lock:
+            for key, (_, expires_at) in list(self._calls.items()):
+                if expires_at is not None:
+                    del self._calls[key]
+
+    def _join(self, key):
+        """Return the future for ``key`` and if the caller has to run the call."""
+        now = self.clock()
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                future, expires_at = call
+                if expires_at is None or expires_at > now:
+                    return future, False
+            for other_key, (_, expires_at) in list(self._calls.items()):
+                if expires_at is not None and expires_at <= now:
+                    del self._calls[other_key]
+            future = concurrent.futures.Future()
+            self._calls[key] = (future, None)
+            return future, True
+
+    def _done(self, key, future, result=None, error=None):
+        with self._lock:
+            if error is None and result is not None and self.cooldown > 0:
+                self._calls[key] = (future, self.clock() + self.cooldown)
+            else:
+                del self._calls[key]
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def do(self, key, fn, *args, **kwds):
+        """Call ``fn(*args, **kwds)``, unless a call for ``key`` is in flight."""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                try:
+                    result = fn(*args, **kwds)
+                except Exception as error:
+                    self._done(key, future, error=error)
+                    raise
+                except BaseException:
+                    self._done(key, future, error=_Abandoned())
+                    raise
+                self._done(key, future, result)
+                return result
+            try:
+                return future.result()
+            except _Abandoned:
+                pass
+
+    async def ado(self, key, fn, *args, **kwds):
+        """Like :meth:`do`, where ``fn`` is a coroutine function."""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                try:
+                    result = await fn(*args, **kwds)
+                except Exception as error:
+                    self._done(key, future, error=error)
+                    raise
+                except BaseException:
+                    self._done(key, future, error=_Abandoned())
+                    raise
+                self._done(key, future, result)
+                return result
+            try:
+                # A cancelled caller mustn't cancel the call the others wait for.
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _Abandoned:
+                pass
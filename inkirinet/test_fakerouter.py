@@ -0,0 +1,184 @@
+import asyncio
+import socket
+import unittest
+from unittest import mock
+
+from . import routeros
+from .fakerouter import TEST_CERTFILE
+from .fakerouter import FakeRouter
+from .fakerouter import mac_address_for_ip
+
+
+class FakeRouterTest(unittest.TestCase):
+
+    def test_mac_address_for_ip(self):
+        self.assertEqual('02:00:0A:00:01:FF', mac_address_for_ip('10.0.1.255'))
+
+    def test_open_socket_options(self):
+        with FakeRouter() as router:
+            sock = routeros.open_socket('127.0.0.1', router.port)
+            with sock:
+                self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+                self.assertTrue(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+
+    def test_static_lease_lifecycle(self):
+        with FakeRouter() as router:
+            with routeros.connect(**router.connection_settings()) as api:
+                api.poll_leases()
+                api.create_static_lease('pool-Manual', 'foo@bar.com',
+                                        'aa:bb:cc:dd:ee:ff', '10MB')
+                api.poll_leases()
+                self.assertIsNotNone(
+                    api.get_static_lease_by_mac_address('pool-Manual', 'AA:BB:CC:DD:EE:FF'))
+                api.remove_static_lease('pool-Manual', 'AA:BB:CC:DD:EE:FF')
+            self.assertEqual({}, router.leases)
+
+    def test_poll_leases_when_not_full_then_only_changed_leases_downloaded(self):
+        with FakeRouter() as router:
+            lease_id = router.add_lease(**{'address': '10.0.0.2', 'dynamic': 'true',
+                                           'status': 'waiting'})
+            lease_cache = mock.Mock()
+            with routeros.connect(**router.connection_settings(),
+                                  lease_cache=lease_cache) as api:
+                api.poll_leases()
+                leases = api.leases
+                self.assertEqual((set(), set()), api.poll_leases(full=False))
+                self.assertIs(leases, api.leases)
+                lease_cache.update.assert_called_with(leases, leases)
+                router.leases[lease_id].update({'status': 'bound',
+                                                'mac-address': 'aa:bb:cc:dd:ee:ff',
+                                                'active-address': '10.0.0.2'})
+                self.assertEqual((set(), set()), api.poll_leases(full=False))
+                self.assertEqual('AA:BB:CC:DD:EE:FF', api.leases[lease_id].mac_address)
+
+    def test_tls_sessions_resumed(self):
+
+        async def get_mac_address(settings):
+            async with routeros.async_connect(**settings) as api:
+                ssl_object = api.api.writer.get_extra_info('ssl_object')
+                await api.get_mac_address_by_dynamic_ip('10.0.0.2')
+                return ssl_object.session_reused
+
+        with FakeRouter(certfile=TEST_CERTFILE) as router:
+            settings = router.connection_settings()
+            with routeros.connect(**settings) as api:
+                self.assertFalse(api.api.sk.session_reused)
+            self.assertTrue(asyncio.run(get_mac_address(settings)))
+            self.assertTrue(asyncio.run(get_mac_address(settings)))
+            with routeros.connect(**settings) as api:
+                self.assertTrue(api.api.sk.session_reused)
+
+    def test_queue_mode(self):
+        with FakeRouter() as router:
+            settings = router.connection_settings()
+            with routeros.connect(**settings, queue_mode=True) as api:
+                api.ensure_plan_queues()
+                commands = router.commands
+                api.ensure_plan_queues()
+                # A print per menu, nothing to add or set.
+                self.assertEqual(3, router.commands - commands)
+                api.poll_leases()
+                api.create_static_lease('pool-Manual', 'foo@bar.com',
+                                        'aa:bb:cc:dd:ee:ff', '10MB')
+            plans = len(routeros.Mikrotik.RATE_LIMIT)
+            for table in ('/queue/type', '/queue/tree', '/ip/firewall/mangle'):
+                self.assertEqual(2 * plans, len(router.tables[table]))
+            queue_types = {t['name']: t for t in router.tables['/queue/type'].values()}
+            self.assertEqual('20M', queue_types['inkirinet-10MB-download']['pcq-rate'])
+            lease, = router.leases.values()
+            self.assertEqual('inkirinet-10MB', lease['address-lists'])
+            self.assertEqual('', lease['rate-limit'])
+
+    def test_update_static_lease_when_queue_mode_turned_on(self):
+        with FakeRouter() as router:
+            settings = router.connection_settings()
+            with routeros.connect(**settings) as api:
+                api.poll_leases()
+                api.create_static_lease('pool-Manual', 'foo@bar.com',
+                                        'aa:bb:cc:dd:ee:ff', '10MB')
+            with routeros.connect(**settings, queue_mode=True) as api:
+                api.poll_leases()
+                self.assertTrue(api.update_static_lease('pool-Manual', 'foo@bar.com',
+                                                        'aa:bb:cc:dd:ee:ff', '10MB'))
+                api.poll_leases()
+                self.assertFalse(api.update_static_lease('pool-Manual', 'foo@bar.com',
+                                                         'aa:bb:cc:dd:ee:ff', '10MB'))
+            lease, = router.leases.values()
+            self.assertEqual('inkirinet-10MB', lease['address-lists'])
+            self.assertEqual('', lease['rate-limit'])
+
+    def test_timeout(self):
+        with FakeRouter() as router:
+            with routeros.connect(**router.connection_settings(), timeout=0.2) as api:
+                router.latency = 0.5
+                with self.assertRaises(routeros.RouterOSTimeoutError):
+                    api.poll_leases()
+                with self.assertRaises(routeros.RouterOSConnectionError):
+                    api.poll_leases()
+
+    def test_connection_refused(self):
+        with FakeRouter() as router:
+            settings = router.connection_settings()
+        with self.assertRaises(routeros.RouterOSConnectionError):
+            with routeros.connect(**settings):
+                pass
+
+        async def connect(settings):
+            async with routeros.async_connect(**settings):
+                pass
+
+        with self.assertRaises(routeros.RouterOSConnectionError):
+            asyncio.run(connect(settings))
+
+    def test_deadline(self):
+        with FakeRouter(latency=0.1) as router:
+            with routeros.connect(**router.connection_settings()) as api:
+                with self.assertRaises(routeros.RouterOSTimeoutError):
+                    with api.deadline(0.15):
+                        api.poll_leases()
+                        api.poll_leases()
+
+    def test_timeout_async(self):
+
+        async def get_mac_address(settings):
+            async with routeros.async_connect(**settings, timeout=0.2) as api:
+                return await api.get_mac_address_by_dynamic_ip('10.0.0.2')
+
+        with FakeRouter() as router:
+            settings = router.connection_settings()
+            router.latency = 0.5
+            with self.assertRaises(routeros.RouterOSTimeoutError):
+                asyncio.run(get_mac_address(settings))
+
+    def test_remove_leases_in_one_command(self):
+        with FakeRouter() as router:
+            lease_ids = [router.add_lease(address=f'10.0.0.{i}', dynamic='true')
+                         for i in range(5)]
+            with routeros.connect(**router.connection_settings()) as api:
+                commands = router.commands
+                api.remove_leases(lease_ids)
+                self.assertEqual(1, router.commands - commands)
+            self.assertEqual({}, router.leases)
+
+    def test_remove_leases_when_some_gone_then_remove_the_others(self):
+        with FakeRouter() as router:
+            lease_ids = [router.add_lease(address=f'10.0.0.{i}', dynamic='true')
+                         for i in range(3)]
+            with routeros.connect(**router.connection_settings()) as api:
+                api.remove_leases(lease_ids[:1])
+                api.remove_leases(lease_ids)
+            self.assertEqual({}, router.leases)
+
+    def test_get_mac_address_by_dynamic_ip_async(self):
+
+        async def get_mac_address(settings):
+            async with routeros.async_connect(**settings) as api:
+                return await api.get_mac_address_by_dynamic_ip('10.0.0.2')
+
+        with FakeRouter() as router:
+            self.assertEqual(mac_address_for_ip('10.0.0.2'),
+                             asyncio.run(get_mac_address(router.connection_settings())))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import unittest
+
+from . import leasesnapshot
+from .routeros import Lease
+
+
+class LeaseSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'leases.snapshot')
+
+    def test_save_and_load(self):
+        leases = {
+            '*1': Lease(**{'.id': '*1', 'address': 'pool-Manual', 'dynamic': 'false',
+                           'mac-address': 'AA:BB:CC:DD:EE:FF', 'comment': '2MB ação'}),
+            '*2': Lease(**{'.id': '*2', 'address': '10.0.0.2', 'dynamic': 'true',
+                           'status': 'bound', 'active-address': '10.0.0.2'}),
+        }
+        leasesnapshot.save(self.path, leases)
+        loaded = leasesnapshot.load(self.path)
+        self.assertEqual(leases, loaded)
+        self.assertIs(leases['*1'].dynamic, loaded['*1'].dynamic)
+
+    def test_load_when_missing_then_none(self):
+        self.assertIsNone(leasesnapshot.load(self.path))
+
+    def test_load_when_corrupt_then_none(self):
+        leasesnapshot.save(self.path, {'*1': Lease(**{'.id': '*1', 'comment': 'foo'})})
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        with self.assertLogs('inkirinet.leasesnapshot', 'WARNING'):
+            self.assertIsNone(leasesnapshot.load(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+
+from . import macaddress
+
+
+class NormalizeTest(unittest.TestCase):
+
+    def test_normalize(self):
+        for value in ('aa:bb:cc:dd:ee:0f', 'AA-BB-CC-DD-EE-0F', 'aabb.ccdd.ee0f',
+                      'AABBCCDDEE0F', ' aa:bb:cc:dd:ee:0f\n'):
+            with self.subTest(value=value):
+                self.assertEqual('AA:BB:CC:DD:EE:0F', macaddress.normalize(value))
+
+    def test_normalize_when_invalid_then_raise(self):
+        for value in ('', 'my phone', 'AA:BB:CC:DD:EE', 'GG:BB:CC:DD:EE:FF'):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                macaddress.normalize(value)
+
+    def test_normalize_or_keep(self):
+        self.assertEqual('AA:BB:CC:DD:EE:FF', macaddress.normalize_or_keep('aa-bb-cc-dd-ee-ff'))
+        self.assertEqual('my phone', macaddress.normalize_or_keep('my phone'))
+        self.assertIsNone(macaddress.normalize_or_keep(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
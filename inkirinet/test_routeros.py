@@ -0,0 +1,347 @@
+import asyncio
+import hashlib
+import socket
+import ssl
+import unittest
+from unittest import mock
+
+from .routeros import ApiRos
+from .routeros import AsyncApiRos
+from .routeros import Lease
+from .routeros import LeaseCache
+from .routeros import LeaseChangeset
+from .routeros import Mikrotik
+from .routeros import RouterOSConnectionError
+from .routeros import RouterOSError
+from .routeros import canonical_value
+from .routeros import check_fingerprint
+from .routeros import quote_script_string
+from .routeros import render_lease_script
+from .routeros import tls_context
+from .routeros import encode_length
+from .routeros import encode_sentence
+
+
+class EncodingTest(unittest.TestCase):
+
+    def test_encode_length(self):
+        self.assertEqual(b'\x7f', encode_length(0x7f))
+        self.assertEqual(b'\x80\x80', encode_length(0x80))
+        self.assertEqual(b'\xc0\x40\x00', encode_length(0x4000))
+        self.assertEqual(b'\xe0\x20\x00\x00', encode_length(0x200000))
+        self.assertEqual(b'\xf0\x10\x00\x00\x00', encode_length(0x10000000))
+
+    def test_encode_sentence(self):
+        self.assertEqual(b'\x05/quit\x00', encode_sentence(['/quit']))
+
+
+class AsyncApiRosTest(unittest.TestCase):
+
+    def talk(self, data, words):
+
+        class Writer:
+            written = b''
+
+            def write(self, data):
+                self.written += data
+
+            async def drain(self):
+                pass
+
+            def close(self):
+                pass
+
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            writer = Writer()
+            replies = await AsyncApiRos(reader, writer).talk(words)
+            return writer.written, replies
+
+        return asyncio.run(run())
+
+    def test_talk(self):
+        written, replies = self.talk(
+            encode_sentence(['!re', '=mac-address=AA:BB:CC:DD:EE:FF'])
+            + encode_sentence(['!done']),
+            ['/ip/dhcp-server/lease/print'])
+        self.assertEqual(encode_sentence(['/ip/dhcp-server/lease/print']), written)
+        self.assertEqual([('!re', {'mac-address': 'AA:BB:CC:DD:EE:FF'}), ('!done', {})],
+                         replies)
+
+    def test_talk_when_closed_then_connection_error(self):
+        with self.assertRaises(RouterOSConnectionError):
+            self.talk(encode_sentence(['!re', '=mac-address=AA:BB:CC:DD:EE:FF']),
+                      ['/ip/dhcp-server/lease/print'])
+
+
+class ApiRosTest(unittest.TestCase):
+
+    def test_talk_when_closed_then_connection_error(self):
+        router, client = socket.socketpair()
+        router.close()
+        api = ApiRos(client)
+        with self.assertRaises(RouterOSConnectionError):
+            api.talk(['/ip/dhcp-server/lease/print'])
+        self.assertEqual(-1, client.fileno())
+
+    def test_read_long_words(self):
+        router, client = socket.socketpair()
+        self.addCleanup(router.close)
+        self.addCleanup(client.close)
+        comment = 'x' * 200
+        router.sendall(encode_sentence(['!re', f'=comment={comment}'])
+                       + encode_sentence(['!done']))
+        self.assertEqual([('!re', {'comment': comment}), ('!done', {})],
+                         ApiRos(client).talk(['/system/script/print']))
+
+
+class DictCache(dict):
+
+    def get(self, key, default=None):
+        return super().get(key, default)
+
+    def set(self, key, value, timeout=None):
+        self[key] = value
+
+    def set_many(self, data, timeout=None):
+        self.update(data)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.pop(key, None)
+
+
+class LeaseCacheTest(unittest.TestCase):
+
+    def lease(self, address, mac_address, dynamic='true', status='bound'):
+        return {'active-address': address,
+                'mac-address': mac_address,
+                'dynamic': dynamic,
+                'status': status}
+
+    def test_update(self):
+        lease_cache = LeaseCache(DictCache())
+        lease_cache.update({}, {
+            '*1': self.lease('10.0.0.1', 'AA:AA:AA:AA:AA:AA'),
+            '*2': self.lease('10.0.0.2', 'BB:BB:BB:BB:BB:BB'),
+            '*3': self.lease('10.0.0.3', 'CC:CC:CC:CC:CC:CC', dynamic='false'),
+            '*4': self.lease('10.0.0.4', 'DD:DD:DD:DD:DD:DD', status='waiting'),
+        })
+        self.assertEqual('AA:AA:AA:AA:AA:AA', lease_cache.get_mac_address('10.0.0.1'))
+        self.assertEqual('BB:BB:BB:BB:BB:BB', lease_cache.get_mac_address('10.0.0.2'))
+        self.assertIsNone(lease_cache.get_mac_address('10.0.0.3'))
+        self.assertIsNone(lease_cache.get_mac_address('10.0.0.4'))
+
+    def test_update_writes_table_when_changed_or_refresh(self):
+        clock = mock.Mock(return_value=0.0)
+        cache = DictCache()
+        lease_cache = LeaseCache(cache, timeout=120, clock=clock)
+        old = {'*1': self.lease('10.0.0.1', 'AA:AA:AA:AA:AA:AA')}
+        lease_cache.update({}, old)
+        new = {**old, '*2': self.lease('10.0.0.2', 'BB:BB:BB:BB:BB:BB')}
+        with mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            clock.return_value = 10.0
+            lease_cache.update(old, new)
+            set_many.assert_called_once()
+            self.assertEqual(2, len(cache[LeaseCache.TABLE_KEY][1]))
+            set_many.reset_mock()
+            clock.return_value = 20.0
+            lease_cache.update(new, new)
+            set_many.assert_not_called()
+            clock.return_value = 70.0
+            lease_cache.update(new, new)
+            set_many.assert_called_once()
+
+    def test_get_mac_address_reads_table_once_per_version(self):
+        cache = DictCache()
+        lease_cache = LeaseCache(cache)
+        leases = {'*1': self.lease('10.0.0.1', 'AA:AA:AA:AA:AA:AA')}
+        lease_cache.update({}, leases)
+        with mock.patch.object(cache, 'get', wraps=cache.get) as get:
+            for _ in range(3):
+                self.assertEqual('AA:AA:AA:AA:AA:AA', lease_cache.get_mac_address('10.0.0.1'))
+            self.assertEqual(1, [c[0][0] for c in get.call_args_list].count(LeaseCache.TABLE_KEY))
+        lease_cache.set_mac_address('10.0.0.2', 'BB:BB:BB:BB:BB:BB')
+        self.assertEqual('BB:BB:BB:BB:BB:BB', lease_cache.get_mac_address('10.0.0.2'))
+
+    def test_update_when_lease_gone_then_forget(self):
+        lease_cache = LeaseCache(DictCache())
+        old = {'*1': self.lease('10.0.0.1', 'AA:AA:AA:AA:AA:AA')}
+        lease_cache.update({}, old)
+        lease_cache.update(old, {})
+        self.assertIsNone(lease_cache.get_mac_address('10.0.0.1'))
+
+
+class LeaseTest(unittest.TestCase):
+
+    def test_from_words(self):
+        lease = Lease.from_words(['=.id=*1A', '=mac-address=aa:bb:cc:dd:ee:ff',
+                                  '=dynamic=true', '=host-name=phone'])
+        self.assertEqual('*1A', lease['.id'])
+        self.assertEqual('AA:BB:CC:DD:EE:FF', lease['mac-address'])
+        self.assertEqual('AA:BB:CC:DD:EE:FF', lease.mac_address)
+        self.assertIsNone(lease.get('host-name'))
+        self.assertEqual('', lease.get('active-address', ''))
+        with self.assertRaises(KeyError):
+            lease['active-address']
+
+    def test_values_are_interned(self):
+        status = ''.join(['bo', 'und'])
+        lease = Lease.from_words([f'=status={status}'])
+        self.assertIs(Lease.from_words(['=status=bound']).status, lease.status)
+
+    def test_has_no_dict(self):
+        with self.assertRaises(AttributeError):
+            Lease().foo = 'bar'
+
+
+class MikrotikTest(unittest.TestCase):
+
+    def test_lease_lookups_by_mac_address_in_any_form(self):
+        api = Mikrotik(None)
+        api.leases = {
+            '*1': Lease(**{'.id': '*1', 'address': 'pool', 'dynamic': 'false',
+                           'mac-address': 'aa-bb-cc-dd-ee-ff'}),
+            '*2': Lease(**{'.id': '*2', 'address': '10.0.0.2', 'dynamic': 'true',
+                           'mac-address': 'AA:BB:CC:DD:EE:FF'}),
+            '*3': Lease(**{'.id': '*3', 'address': '10.0.0.3', 'dynamic': 'true',
+                           'mac-address': '11:22:33:44:55:66'}),
+        }
+        self.assertEqual({'.id': '*1'},
+                         api.get_static_lease_by_mac_address('pool', 'aabb.ccdd.eeff'))
+        self.assertIsNone(api.get_static_lease_by_mac_address('other', 'AA:BB:CC:DD:EE:FF'))
+        self.assertEqual([{'.id': '*2'}],
+                         api.list_dynamic_leases_by_mac_address('aa:bb:cc:dd:ee:ff'))
+
+    def test_query_leases_when_failed_then_raise_after_done(self):
+        replies = [['!re', '=.id=*1'], ['!trap', '=message=failure'], ['!done']]
+        read = []
+
+        def talk_sentences(words):
+            for sentence in replies:
+                read.append(sentence)
+                yield sentence
+
+        api = Mikrotik(mock.Mock(talk_sentences=talk_sentences))
+        for query in (api.query_leases, api.query_lease_markers):
+            read.clear()
+            with self.assertRaises(RouterOSError):
+                query()
+            self.assertEqual(replies, read)
+
+    def test_lease_changes_added_to_changeset(self):
+        api = Mikrotik(None)
+        api.leases = {
+            '*1': Lease(**{'.id': '*1', 'address': '10.0.0.2', 'dynamic': 'true',
+                           'mac-address': 'AA:BB:CC:DD:EE:FF'}),
+            '*2': Lease(**{'.id': '*2', 'address': 'pool', 'dynamic': 'false',
+                           'mac-address': '11:22:33:44:55:66',
+                           'comment': '10MB foo@bar @inkirinet'}),
+        }
+        changeset = LeaseChangeset()
+        api.create_static_lease('pool', 'foo@bar', 'AA:BB:CC:DD:EE:FF', '10MB', changeset)
+        self.assertTrue(api.update_static_lease('pool', 'foo@bar', '11:22:33:44:55:66', '4MB',
+                                                changeset))
+        api.remove_static_lease('pool', '11:22:33:44:55:66', changeset)
+        self.assertEqual(['add', 'remove', 'set', 'remove'],
+                         [action for action, _, _ in changeset.operations])
+        self.assertEqual(['*1', '*2', '*2'],
+                         [lease_id for _, lease_id, _ in changeset.operations[1:]])
+
+
+    def test_canonical_value(self):
+        for spellings in (('no', 'false'), ('yes', 'true'), ('90s', '1m30s', '00:01:30'),
+                          ('20M', '20000000'), ('8s', '8s')):
+            self.assertEqual({canonical_value(spellings[0])},
+                             {canonical_value(value) for value in spellings})
+        self.assertNotEqual(canonical_value('1m'), canonical_value('1M'))
+        self.assertNotEqual(canonical_value('true'), canonical_value('1'))
+        self.assertEqual('global', canonical_value('global'))
+
+
+class ScriptApi:
+    """Answers the script commands, as if each script applied all its operations."""
+
+    def __init__(self):
+        self.commands = []
+        self.scripts = {}
+
+    def talk(self, words):
+        self.commands.append(words[0])
+        attrs = dict(w[1:].split('=', 1) for w in words[1:] if w.startswith('='))
+        if words[0] == '/system/script/add':
+            script_id = f'*{len(self.commands)}'
+            self.scripts[script_id] = attrs['source']
+            return [('!done', {'ret': script_id})]
+        if words[0] == '/system/script/print':
+            operations = self.scripts[words[1][len('?.id='):]].count(':do {')
+            return [('!re', {'comment': f'inkirinet applied={operations} failed=0'}),
+                    ('!done', {})]
+        if words[0] == '/system/script/remove':
+            del self.scripts[attrs['.id']]
+        return [('!done', {})]
+
+
+class LeaseScriptTest(unittest.TestCase):
+
+    def test_quote_script_string(self):
+        self.assertEqual(r'"a \"b\" \$c \\d\n"', quote_script_string('a "b" $c \\d\n'))
+
+    def test_render_lease_script(self):
+        changeset = LeaseChangeset()
+        changeset.add(address='pool', mac_address='AA:BB:CC:DD:EE:FF')
+        changeset.set('*1A', rate_limit='2M/2M')
+        changeset.remove('*2')
+        script = render_lease_script(changeset.operations, 'foo')
+        self.assertIn('/ip dhcp-server lease add address="pool" mac-address="AA:BB:CC:DD:EE:FF";',
+                      script)
+        self.assertIn('/ip dhcp-server lease set *1A rate-limit="2M/2M";', script)
+        self.assertIn('/ip dhcp-server lease remove *2;', script)
+        self.assertIn('/system script set [find name="foo"]', script)
+
+    def test_render_lease_script_when_bad_id_then_raise(self):
+        with self.assertRaises(ValueError):
+            render_lease_script([('remove', '*1; /system reboot', {})], 'foo')
+
+    def test_apply_lease_changeset_in_batches(self):
+        api = ScriptApi()
+        mikrotik = Mikrotik(api)
+        mikrotik.SCRIPT_BATCH_SIZE = 2
+        changeset = LeaseChangeset()
+        for i in range(3):
+            changeset.remove(f'*{i}')
+        self.assertEqual((3, 0), mikrotik.apply_lease_changeset(changeset))
+        self.assertEqual(2, api.commands.count('/system/script/run'))
+        self.assertEqual({}, api.scripts)
+
+
+class TlsTest(unittest.TestCase):
+
+    def test_tls_context_anonymous(self):
+        context = tls_context()
+        self.assertIs(context, tls_context())
+        self.assertEqual(ssl.CERT_NONE, context.verify_mode)
+        self.assertEqual(ssl.TLSVersion.TLSv1_2, context.maximum_version)
+        self.assertIn('ADH-AES128-SHA256', [c['name'] for c in context.get_ciphers()])
+
+    def test_tls_context_pinned(self):
+        context = tls_context(fingerprint='AB:CD')
+        self.assertIsNot(context, tls_context())
+        self.assertNotIn('ADH-AES128-SHA256', [c['name'] for c in context.get_ciphers()])
+
+    def test_check_fingerprint(self):
+        class SSLObject:
+            def getpeercert(self, binary_form=False):
+                return b'certificate'
+
+        fingerprint = hashlib.sha256(b'certificate').hexdigest().upper()
+        check_fingerprint(SSLObject(), ':'.join(fingerprint[i:i + 2]
+                                                for i in range(0, len(fingerprint), 2)))
+        with self.assertRaises(ssl.SSLCertVerificationError):
+            check_fingerprint(SSLObject(), '00' * 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+from unittest import mock
+
+from .scheduler import AdaptiveInterval
+from .scheduler import Backoff
+from .scheduler import Poller
+from .scheduler import TokenBucket
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_take_within_capacity_then_no_wait(self):
+        bucket = TokenBucket(1.0, 2, clock=FakeClock())
+        self.assertEqual(0, bucket.take())
+        self.assertEqual(0, bucket.take())
+
+    def test_take_when_empty_then_wait_for_refill(self):
+        clock = FakeClock()
+        bucket = TokenBucket(0.5, 1, clock=clock)
+        self.assertEqual(0, bucket.take())
+        self.assertEqual(2.0, bucket.take())
+        clock.sleep(2.0)
+        self.assertEqual(2.0, bucket.take())
+
+
+class BackoffTest(unittest.TestCase):
+
+    def test_next_doubles_until_cap(self):
+        backoff = Backoff(base=1.0, cap=5.0, random=lambda: 1.0)
+        self.assertEqual([1.0, 2.0, 4.0, 5.0],
+                         [backoff.next() for _ in range(4)])
+        backoff.reset()
+        self.assertEqual(1.0, backoff.next())
+
+
+class AdaptiveIntervalTest(unittest.TestCase):
+
+    def test_update(self):
+        interval = AdaptiveInterval(10, 35)
+        self.assertEqual(20, interval.update(False))
+        self.assertEqual(35, interval.update(False))
+        self.assertEqual(10, interval.update(True))
+
+
+class PollerTest(unittest.TestCase):
+
+    def create_poller(self, poll, clock):
+        return Poller(poll,
+                      budget=TokenBucket(1.0, 1, clock=clock),
+                      interval=AdaptiveInterval(10, 40),
+                      backoff=Backoff(base=1.0, cap=60.0, random=lambda: 1.0),
+                      is_retryable=lambda e: isinstance(e, ConnectionError),
+                      retry_after=lambda e: 30.0,
+                      sleep=clock.sleep)
+
+    def test_run_when_retryable_error_then_backoff(self):
+        clock = FakeClock()
+        poll = mock.Mock(side_effect=[ConnectionError(), True])
+        with self.assertLogs('inkirinet.scheduler', 'WARNING') as logs:
+            self.create_poller(poll, clock).run(iterations=2)
+        self.assertIn('Poll failed, retrying in 30.0s', logs.output[0])
+        self.assertEqual(2, poll.call_count)
+        # Retry-After (30s) wins over the backoff (1s), then the minimum
+        # interval after a change.
+        self.assertEqual(40.0, clock.now)
+
+    def test_run_when_other_error_then_raise(self):
+        clock = FakeClock()
+        poll = mock.Mock(side_effect=ValueError())
+        with self.assertRaises(ValueError):
+            self.create_poller(poll, clock).run(iterations=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
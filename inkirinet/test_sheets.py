@@ -1,7 +1,17 @@
 import unittest
 from unittest import mock
 
+import google.auth.exceptions
+import httplib2
+
+from .sheets import RowError
+from .sheets import SCOPES
 from .sheets import Spreadsheet
+from .sheets import WRITE_SCOPES
+from .sheets import build_service
+from .sheets import is_retryable
+from .sheets import parse_row
+from .sheets import parse_rows
 
 
 class SpreadsheetTest(unittest.TestCase):
@@ -10,6 +20,30 @@ class SpreadsheetTest(unittest.TestCase):
     discovery_mock = mock.MagicMock()
     discovery_mock.return_value.spreadsheets.return_value = sheets_mock
 
+    def setUp(self):
+        build_service.cache_clear()
+        self.discovery_mock.reset_mock()
+
+    @mock.patch('googleapiclient.discovery.build', discovery_mock)
+    def test_service_is_built_once_per_key_file(self):
+        with mock.patch('google.oauth2.service_account.Credentials.from_service_account_file') \
+                as from_file_mock:
+            one = Spreadsheet('/dev/null', 'one')
+            two = Spreadsheet('/dev/null', 'two')
+        self.assertIs(one.sheets, two.sheets)
+        from_file_mock.assert_called_once_with('/dev/null')
+        self.discovery_mock.assert_called_once()
+
+    @mock.patch('googleapiclient.discovery.build', discovery_mock)
+    def test_service_is_read_only_unless_writable(self):
+        with mock.patch('google.oauth2.service_account.Credentials.from_service_account_file'), \
+                mock.patch('google.auth.credentials.with_scopes_if_required') as scopes_mock:
+            Spreadsheet('/dev/null', 'id')
+            Spreadsheet('/dev/null', 'id', writable=True)
+        self.assertEqual([SCOPES, WRITE_SCOPES],
+                         [c.args[1] for c in scopes_mock.call_args_list])
+        self.assertEqual(['https://www.googleapis.com/auth/spreadsheets.readonly'], SCOPES)
+
     @mock.patch('googleapiclient.discovery.build', discovery_mock)
     def test_read_all_if_(self):
         (self.sheets_mock
@@ -41,6 +75,93 @@ class SpreadsheetTest(unittest.TestCase):
         ret = spreadsheet.read_all()
         self.assertTrue(ret['foo@bar.com'].active)
 
+    @mock.patch('googleapiclient.discovery.build', discovery_mock)
+    def test_write_statuses_when_changed_then_one_batch_update(self):
+        with mock.patch('google.oauth2.service_account.Credentials.from_service_account_file'):
+            spreadsheet = Spreadsheet('/dev/null', 'id')
+        spreadsheet.statuses = {2: 'a', 3: 'b', 4: 'c'}
+        written = spreadsheet.write_statuses({2: 'a', 3: 'B', 4: 'C', 5: 'd', 7: 'e'})
+        self.assertEqual(4, written)
+        batch_update = self.sheets_mock.values.return_value.batchUpdate
+        batch_update.assert_called_once_with(
+            spreadsheetId='id',
+            body={'valueInputOption': 'RAW',
+                  'data': [{'range': 'S3:S5', 'values': [['B'], ['C'], ['d']]},
+                           {'range': 'S7:S7', 'values': [['e']]}]})
+        batch_update.reset_mock()
+        self.assertEqual(0, spreadsheet.write_statuses({2: 'a', 3: 'B', 4: 'C', 5: 'd',
+                                                        7: 'e'}))
+        batch_update.assert_not_called()
+
+    @mock.patch('googleapiclient.discovery.build', discovery_mock)
+    def test_write_statuses_when_row_gone_then_cleared(self):
+        with mock.patch('google.oauth2.service_account.Credentials.from_service_account_file'):
+            spreadsheet = Spreadsheet('/dev/null', 'id', writable=True)
+        spreadsheet.statuses = {2: 'a', 3: 'b'}
+        self.assertEqual(1, spreadsheet.write_statuses({2: 'a'}))
+        self.sheets_mock.values.return_value.batchUpdate.assert_called_once_with(
+            spreadsheetId='id',
+            body={'valueInputOption': 'RAW',
+                  'data': [{'range': 'S3:S3', 'values': [['']]}]})
+        self.assertEqual({2: 'a'}, spreadsheet.statuses)
+
+
+class IsRetryableTest(unittest.TestCase):
+
+    def test_network_errors_are_retryable(self):
+        self.assertTrue(is_retryable(ConnectionResetError()))
+        self.assertTrue(is_retryable(httplib2.ServerNotFoundError()))
+        self.assertTrue(is_retryable(google.auth.exceptions.TransportError()))
+        self.assertFalse(is_retryable(ValueError()))
+
+
+class ParseRowTest(unittest.TestCase):
+
+    row = ('01/01/2020 13:08:10',
+           '10Mbps por dispositivo (ik$150)',
+           '2 (Padrão, sem custo adicional)',
+           '',
+           'FOO BAR',
+           '',
+           'Foo@Bar.com',
+           'Estou de acordo',
+           'aa:bb:cc:dd:ee:ff - Phone\n11-22-33-44-55-66')
+
+    def test_parse_row(self):
+        contract, errors = parse_row(2, self.row)
+        self.assertEqual([], errors)
+        self.assertEqual('foo@bar.com', contract.email)
+        self.assertEqual('Foo Bar', contract.name)
+        self.assertEqual('10MB', contract.plan_type)
+        self.assertEqual(2, contract.max_devices)
+        self.assertEqual(2, contract.row)
+        self.assertEqual('2020-01-01T13:08:10-03:00', contract.created_at.isoformat())
+        self.assertEqual({'AA:BB:CC:DD:EE:FF', '11:22:33:44:55:66'}, contract.devices)
+
+    def test_parse_row_when_more_speed_plan_then_50mb(self):
+        row = self.row[:1] + ('Mais velocidade (ik$150 + ik$10 por cada 1Mbps)',) + self.row[2:]
+        contract, errors = parse_row(2, row)
+        self.assertEqual([], errors)
+        self.assertEqual('50MB', contract.plan_type)
+
+    def test_parse_row_when_bad_mac_then_contract_and_error(self):
+        row = self.row[:8] + ('aa:bb:cc:dd:ee:ff\nmy phone',)
+        contract, errors = parse_row(5, row)
+        self.assertEqual({'AA:BB:CC:DD:EE:FF'}, contract.devices)
+        self.assertEqual([RowError(5, 'devices', "Invalid MAC address, ignoring: 'my phone'.")],
+                         errors)
+
+    def test_parse_row_when_invalid_then_errors(self):
+        row = ('31/02/2020 13:08:10', 'Nenhum') + self.row[2:]
+        contract, errors = parse_row(3, row)
+        self.assertIsNone(contract)
+        self.assertEqual(['plan_type', 'created_at'], [e.field for e in errors])
+
+    def test_parse_rows_numbers_rows(self):
+        contracts, errors = parse_rows([self.row, ('',), self.row])
+        self.assertEqual([2, 4], [c.row for c in contracts])
+        self.assertEqual({3}, {e.row for e in errors})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import unittest
+
+from .singleflight import Group
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class GroupTest(unittest.TestCase):
+
+    def test_do_when_concurrent_then_single_call(self):
+        group = Group()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'result'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(group.do('key', slow)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(group.do('key', slow)))
+                     for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual([1], calls)
+        self.assertEqual(['result'] * 4, results)
+
+    def test_do_within_cooldown_then_cached(self):
+        clock = FakeClock()
+        group = Group(cooldown=5, clock=clock)
+        self.assertEqual(1, group.do('key', lambda: 1))
+        clock.now = 4
+        self.assertEqual(1, group.do('key', lambda: 2))
+        self.assertEqual(3, group.do('other', lambda: 3))
+        clock.now = 6
+        self.assertEqual(4, group.do('key', lambda: 4))
+
+    def test_do_when_error_then_not_cached(self):
+        group = Group(cooldown=5)
+
+        def fail():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            group.do('key', fail)
+        self.assertEqual(1, group.do('key', lambda: 1))
+
+    def test_do_when_none_then_not_cached(self):
+        group = Group(cooldown=5)
+        self.assertIsNone(group.do('key', lambda: None))
+        self.assertEqual(1, group.do('key', lambda: 1))
+
+    def test_ado_when_leader_cancelled_then_follower_calls(self):
+        group = Group()
+        calls = []
+
+        async def slow(result):
+            calls.append(result)
+            await asyncio.sleep(0.01)
+            return result
+
+        async def run():
+            leader = asyncio.ensure_future(group.ado('key', slow, 'leader'))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(group.ado('key', slow, 'follower'))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await follower
+
+        self.assertEqual('follower', asyncio.run(run()))
+        self.assertEqual(['leader', 'follower'], calls)
+
+    def test_ado_when_follower_cancelled_then_others_get_result(self):
+        group = Group()
+
+        async def slow():
+            await asyncio.sleep(0.01)
+            return 'result'
+
+        async def run():
+            calls = [asyncio.ensure_future(group.ado('key', slow)) for _ in range(3)]
+            await asyncio.sleep(0)
+            calls[1].cancel()
+            return await asyncio.gather(calls[0], calls[2])
+
+        self.assertEqual(['result', 'result'], asyncio.run(run()))
+
+    def test_ado_when_concurrent_then_single_call(self):
+        group = Group()
+        calls = []
+
+        async def slow():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'result'
+
+        async def run():
+            return await asyncio.gather(*[group.ado('key', slow) for _ in range(5)])
+
+        self.assertEqual(['result'] * 5, asyncio.run(run()))
+        self.assertEqual([1], calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
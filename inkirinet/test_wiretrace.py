@@ -0,0 +1,53 @@
+import json
+import os
+import tempfile
+import unittest
+
+from . import routeros
+from .fakerouter import FakeRouter
+from .wiretrace import WireTracer
+
+
+class WireTracerTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'wire.log')
+
+    def records(self):
+        with open(self.path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_trace_commands(self):
+        tracer = WireTracer(self.path)
+        self.addCleanup(tracer.close)
+        with FakeRouter() as router:
+            router.add_lease(address='10.0.0.2', dynamic='true')
+            with routeros.connect(**router.connection_settings(), tracer=tracer) as api:
+                api.poll_leases()
+                # Gone leases count as removed, but the router replies a trap.
+                api.remove_leases(['*FF'])
+        login, lease_print, remove, *_ = self.records()
+        self.assertEqual('/login', login['command'])
+        self.assertIn('=password=***', login['words'])
+        self.assertNotIn('=password=fake', login['words'])
+        self.assertEqual('/ip/dhcp-server/lease/print', lease_print['command'])
+        self.assertEqual(2, lease_print['replies'])
+        self.assertEqual('!done', lease_print['result'])
+        self.assertGreater(lease_print['received_bytes'], 0)
+        self.assertGreater(lease_print['sent_bytes'], 0)
+        self.assertEqual('!trap', remove['result'])
+
+    def test_sample(self):
+        tracer = WireTracer(self.path, sample_rate=0.5, random=lambda: 0.7)
+        self.addCleanup(tracer.close)
+        self.assertIsNone(tracer.start(['/ip/dhcp-server/lease/print']))
+        tracer.random = lambda: 0.2
+        tracer.start(['/ip/dhcp-server/lease/print']).finish()
+        record, = self.records()
+        self.assertIsNone(record['result'])
+
+
+if __name__ == '__main__':
+    unittest.main()
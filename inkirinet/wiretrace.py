@@ -0,0 +1,90 @@
+"""Trace the RouterOS API commands on the wire.
+
+Tracing is off unless a :class:`WireTracer` is given to the connection, then
+the API only checks ``tracer is not None`` per command and never formats
+words.  Each traced command is written as a JSON line to a rotating file::
+
+    {"time": "...", "command": "/ip/dhcp-server/lease/print",
+     "words": [...], "sent_bytes": 42, "replies": 120,
+     "received_bytes": 18230, "result": "!done", "duration_ms": 12.5}
+"""
+
+import datetime
+import json
+import logging
+import logging.handlers
+import random
+import time
+
+from .routeros import encode_sentence
+
+
+class WireTracer:
+    """Write a record of (a sample of) the API commands to a rotating file.
+
+    :param path: The file, rotated at ``max_bytes`` keeping ``backup_count``
+                 old ones.
+    :param sample_rate: Fraction of the commands traced, between 0 and 1.
+    """
+
+    # Attributes never written, /login's.
+    REDACTED = ('=password=', '=response=')
+
+    def __init__(self, path, *, sample_rate=1.0, max_bytes=10 * 1024 * 1024,
+                 backup_count=5, random=random.random, clock=time.perf_counter):
+        self.sample_rate = sample_rate
+        self.random = random
+        self.clock = clock
+        self.handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+
+    def start(self, words):
+        """Return the trace of a command being sent, or None if not sampled."""
+        if self.sample_rate < 1.0 and self.random() >= self.sample_rate:
+            return None
+        return Trace(self, words)
+
+    def redact(self, words):
+        if not words or words[0] != '/login':
+            return list(words)
+        return [w[:w.index('=', 1) + 1] + '***' if w.startswith(self.REDACTED) else w
+                for w in words]
+
+    def write(self, record):
+        self.handler.handle(logging.makeLogRecord(
+            {'msg': json.dumps(record, ensure_ascii=False)}))
+
+    def close(self):
+        self.handler.close()
+
+
+class Trace:
+    """A traced command, see :meth:`WireTracer.start`."""
+
+    def __init__(self, tracer, words):
+        self.tracer = tracer
+        self.words = words
+        self.replies = 0
+        self.received_bytes = 0
+        # The first reply besides !re (!trap, !fatal or !done), None if the
+        # command didn't finish, e.g. it timed out.
+        self.result = None
+        self.started_at = tracer.clock()
+
+    def reply(self, sentence):
+        self.replies += 1
+        self.received_bytes += len(encode_sentence(sentence))
+        if sentence[0] != '!re' and self.result is None:
+            self.result = sentence[0]
+
+    def finish(self):
+        self.tracer.write({
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'command': self.words[0] if self.words else '',
+            'words': self.tracer.redact(self.words),
+            'sent_bytes': len(encode_sentence(self.words)),
+            'replies': self.replies,
+            'received_bytes': self.received_bytes,
+            'result': self.result,
+            'duration_ms': round((self.tracer.clock() - self.started_at) * 1000, 3),
+        })
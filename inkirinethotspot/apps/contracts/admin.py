@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db.models import Prefetch
+from django.db.models import Q
 from django.utils.html import format_html
 from django.utils.translation import ugettext_lazy as __
 
@@ -41,6 +43,7 @@ class ContractAdmin(admin.ModelAdmin):
                     'plan_type',
                     'is_active',
                     'max_devices',
+                    'devices_count',
                     'devices_view',
                     'created_at',
                     'updated_at')
@@ -51,7 +54,37 @@ class ContractAdmin(admin.ModelAdmin):
 
     inlines = [DevicesInline]
 
-    search_fields = ('email', 'first_name', 'last_name')
+    # E-mails are searched by prefix in `get_search_results()`.
+    search_fields = ('^first_name', '^last_name')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request) \
+                      .with_devices_count() \
+                      .prefetch_related(Prefetch('devices',
+                                                 queryset=Device.objects.order_by('pk')))
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        # A range on the (unique) e-mail index instead of LIKE, which can't
+        # use it.
+        prefix = term.lower()
+        email = Q(email__gte=prefix, email__lt=prefix + '\uffff')
+        if '@' in term:
+            return queryset.filter(email), False
+        # Like the `search_fields` search: every word starts a first or last
+        # name.
+        names = Q()
+        for word in term.split():
+            names &= Q(first_name__istartswith=word) | Q(last_name__istartswith=word)
+        return queryset.filter(names | email), False
+
+    def devices_count(self, obj):
+        return obj.devices_count
+
+    devices_count.short_description = __('Devices count')
+    devices_count.admin_order_field = 'devices_count'
 
     def devices_view(self, obj):
         return format_html(
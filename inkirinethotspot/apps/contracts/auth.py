@@ -8,11 +8,23 @@ class ContractsAuthenticationBackend(ModelBackend):
 
     def authenticate(self, request, contract_email=None, **kwargs):
         """Auth if there is a contract with the specified e-mail."""
+        contract = self.authenticate_contract(request, contract_email)
+        return contract.user if contract else None
+
+    def authenticate_contract(self, request, contract_email):
+        """Return the contract (with its user) for an e-mail if its user can log in.
+
+        The user's backend is set, so it can be passed to `login()` without
+        going through `django.contrib.auth.authenticate()`.
+        """
+        if not contract_email:
+            return None
         try:
-            contract = models.Contract.objects.get_from_email(contract_email)
+            contract = models.Contract.objects.get_from_email_for_login(contract_email)
         except models.Contract.DoesNotExist:
             return None
         user = contract.user
-        if user and self.user_can_authenticate(user):
-            return user
-        return None
+        if not (user and self.user_can_authenticate(user)):
+            return None
+        user.backend = f'{self.__module__}.{self.__class__.__qualname__}'
+        return contract
@@ -0,0 +1,43 @@
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils.translation import gettext_lazy as __
+
+from inkirinet import macaddress
+
+
+def validate_mac_address(value):
+    try:
+        macaddress.normalize(value)
+    except ValueError:
+        raise ValidationError(__("'%(value)s' is not a valid MAC address."),
+                              code='invalid',
+                              params={'value': value})
+
+
+class MACAddressField(models.CharField):
+    """A MAC address stored in the canonical ``'AA:BB:CC:DD:EE:FF'`` form.
+
+    Values are normalized when saved and in lookups, so they match the router
+    leases and each other exactly, whatever form they were written in.  Values
+    that aren't MAC addresses are kept as they are, but don't validate.
+    """
+
+    default_validators = [validate_mac_address]
+
+    def __init__(self, *args, **kwds):
+        kwds.setdefault('max_length', 17)
+        super().__init__(*args, **kwds)
+
+    def deconstruct(self):
+        name, path, args, kwds = super().deconstruct()
+        if kwds.get('max_length') == 17:
+            del kwds['max_length']
+        return name, path, args, kwds
+
+    def to_python(self, value):
+        return macaddress.normalize_or_keep(super().to_python(value))
+
+    def pre_save(self, model_instance, add):
+        value = self.to_python(getattr(model_instance, self.attname))
+        setattr(model_instance, self.attname, value)
+        return value
@@ -1,9 +1,9 @@
 from django import forms
-from django.contrib.auth import authenticate
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as __
 
 from inkirinethotspot.apps.contracts import models
+from inkirinethotspot.apps.contracts.auth import ContractsAuthenticationBackend
 
 
 class ContractLoginForm(forms.Form):
@@ -24,12 +24,13 @@ class ContractLoginForm(forms.Form):
         cleaned_data = super().clean()
         email = cleaned_data.get('email')
         if email is not None:
-            user = authenticate(self.request, contract_email=email)
-            if user is None:
-                raise ValidationError(self.error_messages['failed'])
+            # Contract logins have no password, skip the other backends.
             # TODO In a world where multiple contracts exists per user, this
             #      will need revisiting.
-            self.contract = user.contracts.first()
+            self.contract = ContractsAuthenticationBackend() \
+                .authenticate_contract(self.request, email)
+            if self.contract is None:
+                raise ValidationError(self.error_messages['failed'])
         return cleaned_data
 
     def get_user(self):
@@ -1,8 +1,13 @@
+import contextlib
+
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from inkirinet import leasesnapshot
 from inkirinet import routeros
 from inkirinethotspot.apps.contracts.models import Device
+from inkirinethotspot.apps.contracts.models import get_lease_cache
+from inkirinethotspot.apps.contracts.models import get_wire_tracer
 
 
 class Command(BaseCommand):
@@ -11,14 +16,58 @@ class Command(BaseCommand):
 
     ADDRESS_POOL = 'pool-Manual'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--snapshot',
+            metavar='PATH',
+            help=("Start from the leases saved in this file by the last sync, "
+                  "and only download them again if leases were added or "
+                  "removed, or their status or addresses changed since.  The "
+                  "file is updated after each sync."))
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help=("Apply the new and updated leases at the end, as a script run "
+                  "on the router, instead of a command per change.  Use it for "
+                  "large changes, e.g. a plan's rate limit, over slow links.  "
+                  "Static leases are still removed right away."))
+
     def handle(self, *args, **options):
-        with routeros.connect(**settings.ROUTEROS_API) as api:
-            api.poll_leases()
-            for device in Device.objects.all():
+        snapshot = options.get('snapshot')
+        changeset = routeros.LeaseChangeset() if options.get('bulk') else None
+        with self.connect() as api:
+            leases = leasesnapshot.load(snapshot) if snapshot else None
+            if leases is None:
+                api.poll_leases()
+            else:
+                api.leases = leases
+                new, removed = api.poll_leases(full=False)
+                self.stdout.write(f"{len(new)} new and {len(removed)} removed "
+                                  f"leases since the last sync.\n")
+            for device in Device.objects.select_related('contract'):
                 self.stdout.write(f"At {device} of {device.contract}\n")
-                self.handle_device(api, device)
+                self.handle_device(api, device, changeset)
+            if changeset:
+                applied, failed = api.apply_lease_changeset(changeset)
+                self.stdout.write(f"{applied} lease changes applied, {failed} failed.\n")
+            if snapshot:
+                if api.leases_changed:
+                    # Save the leases as this sync left them.
+                    api.poll_leases()
+                leasesnapshot.save(snapshot, api.leases)
+
+    @contextlib.contextmanager
+    def connect(self):
+        """Connect to the router, with the plans' queues in place in queue mode."""
+        with routeros.connect(**settings.ROUTEROS_API,
+                              lease_cache=get_lease_cache(),
+                              tracer=get_wire_tracer(),
+                              queue_mode=settings.ROUTEROS_QUEUE_MODE) as api:
+            if api.queue_mode:
+                api.ensure_plan_queues()
+            yield api
 
-    def handle_device(self, api, device):
+    def handle_device(self, api, device, changeset=None):
 
         # Each device has two boolean flags:
         #
@@ -32,7 +81,7 @@ class Command(BaseCommand):
         #
         # | CONTRACT | HAS LEASE | Actions                                  |
         # |----------+-----------+------------------------------------------|
-        # | TRUE     | TRUE      | Mark device as active.                   |
+        # | TRUE     | TRUE      | Update lease to plan, mark as active.    |
         # | TRUE     | FALSE     | Add static lease, remove dynamic leases. |
         # | FALSE    | TRUE      | Remove static lease, mark as inactive.   |
         # | FALSE    | FALSE     | Delete device in the database[1].        |
@@ -50,18 +99,30 @@ class Command(BaseCommand):
 
         if is_contracted:
             if has_lease:
+                if api.update_static_lease(self.ADDRESS_POOL,
+                                           device.contract.email,
+                                           device.mac_address,
+                                           device.contract.plan_type,
+                                           changeset):
+                    self.stdout.write(
+                        self.style.SUCCESS(
+                            f'Static lease updated: {device.contract} {device}'))
                 device.has_lease = True
                 device.save()
             else:
                 api.create_static_lease(self.ADDRESS_POOL,
                                         device.contract.email,
                                         device.mac_address,
-                                        device.contract.plan_type)
+                                        device.contract.plan_type,
+                                        changeset)
                 self.stdout.write(
                     self.style.SUCCESS(
                         f'New static lease created: {device.contract} {device}'))
         else:
             if has_lease:
+                # Not in the changeset: the device is deleted (or marked
+                # without lease) next, and a lease left behind by a failed
+                # script would never be removed by a later sync.
                 api.remove_static_lease(self.ADDRESS_POOL, device.mac_address)
                 self.stdout.write(
                     self.style.SUCCESS(
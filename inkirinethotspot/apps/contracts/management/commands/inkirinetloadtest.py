@@ -0,0 +1,143 @@
+import collections
+import concurrent.futures
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from inkirinet.fakerouter import FakeRouter
+from inkirinethotspot.apps.contracts import models
+
+
+Sample = collections.namedtuple('Sample', ('endpoint', 'seconds', 'queries', 'ok'))
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    index = max(0, int(round(percent / 100 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+class Command(BaseCommand):
+
+    help = ("Load test the portal: drive concurrent login, home and add device "
+            "flows against a throwaway database and a fake router, then report "
+            "latency, throughput and queries per endpoint.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=100,
+            help="Synthetic contracts, each one runs a full flow (default: 100).")
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=10,
+            help="Flows running at the same time (default: 10).")
+        parser.add_argument(
+            '--router-latency',
+            type=float,
+            default=0.0,
+            help="Seconds the fake router waits before each reply (default: 0).")
+        parser.add_argument(
+            '--use-current-database',
+            action='store_true',
+            help=("Create the synthetic contracts in the configured database "
+                  "instead of a throwaway one (only for tests)."))
+
+    def handle(self, *args, **options):
+        if options['use_current_database']:
+            self.load_test(options)
+        else:
+            with tempfile.TemporaryDirectory() as directory:
+                self.load_test_in_throwaway_database(directory, options)
+
+    def load_test_in_throwaway_database(self, directory, options):
+        # A file (instead of SQLite's default in memory test database), so
+        # concurrent connections lock it as the real one.
+        connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'loadtest.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.load_test(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def load_test(self, options):
+        emails = [f'loadtest{i}@example.com' for i in range(options['users'])]
+        for email in emails:
+            models.Contract.objects.create_contract(email, max_devices=3)
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                  'routeros': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                               'LOCATION': 'loadtest-routeros'}}
+        with FakeRouter(latency=options['router_latency']) as router, \
+                override_settings(ALLOWED_HOSTS=['testserver'],
+                                  ROUTEROS_API=router.connection_settings(),
+                                  CACHES=caches):
+            started_at = time.perf_counter()
+            samples = []
+            if options['concurrency'] > 1:
+                with concurrent.futures.ThreadPoolExecutor(options['concurrency']) as executor:
+                    for flow_samples in executor.map(self.run_flow_in_thread,
+                                                     enumerate(emails)):
+                        samples.extend(flow_samples)
+            else:
+                for flow_samples in map(self.run_flow, enumerate(emails)):
+                    samples.extend(flow_samples)
+            elapsed = time.perf_counter() - started_at
+        self.report(samples, elapsed, router.commands)
+
+    def run_flow_in_thread(self, user):
+        try:
+            return self.run_flow(user)
+        finally:
+            connection.close()
+
+    def run_flow(self, user):
+        """Login, see the home page and add the current device."""
+        number, email = user
+        ip_address = f'10.{number // 65536 % 256}.{number // 256 % 256}.{number % 256}'
+        client = Client(REMOTE_ADDR=ip_address)
+        requests = [
+            ('GET /login/', lambda: client.get(reverse('contracts:login'))),
+            ('POST /login/', lambda: client.post(reverse('contracts:login'), {'email': email})),
+            ('GET /', lambda: client.get(reverse('contracts:home'))),
+            ('POST /add/', lambda: client.post(reverse('contracts:add'))),
+        ]
+        samples = []
+        for endpoint, request in requests:
+            with CaptureQueriesContext(connection) as queries:
+                started_at = time.perf_counter()
+                response = request()
+                seconds = time.perf_counter() - started_at
+            samples.append(Sample(endpoint, seconds, len(queries),
+                                  response.status_code < 400))
+        return samples
+
+    def report(self, samples, elapsed, router_commands):
+        by_endpoint = collections.defaultdict(list)
+        for sample in samples:
+            by_endpoint[sample.endpoint].append(sample)
+        self.stdout.write(f"{'endpoint':<14} {'requests':>8} {'errors':>6} "
+                          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                          f"{'req/s':>8} {'queries':>8}")
+        for endpoint, endpoint_samples in by_endpoint.items():
+            seconds = sorted(s.seconds for s in endpoint_samples)
+            errors = sum(1 for s in endpoint_samples if not s.ok)
+            queries = sum(s.queries for s in endpoint_samples) / len(endpoint_samples)
+            self.stdout.write(
+                f"{endpoint:<14} {len(seconds):>8} {errors:>6} "
+                f"{percentile(seconds, 50) * 1000:>8.1f} "
+                f"{percentile(seconds, 95) * 1000:>8.1f} "
+                f"{percentile(seconds, 99) * 1000:>8.1f} "
+                f"{len(seconds) / elapsed:>8.1f} {queries:>8.1f}")
+        self.stdout.write(f"{len(samples)} requests in {elapsed:.2f}s, "
+                          f"{router_commands} router commands.")
@@ -0,0 +1,66 @@
+import concurrent.futures
+import contextlib
+
+from inkirinet import routeros
+from inkirinethotspot.apps.contracts.models import Device
+
+from . import inkirinetleasesync
+from . import inkirinetsheetspoll
+
+
+class Command(inkirinetsheetspoll.Command):
+
+    help = ("Poll contracts from the Google's Spreadsheet and sync the leases "
+            "of the new or changed contracts' devices, through a single router "
+            "connection.")
+
+    def handle(self, *args, **options):
+        self.lease_sync = inkirinetleasesync.Command(stdout=self.stdout,
+                                                     stderr=self.stderr)
+        self.connection = None
+        try:
+            super().handle(*args, **options)
+        finally:
+            self.disconnect()
+
+    def connect(self):
+        """Return the router connection, opening it if there is none."""
+        if self.connection is None:
+            with contextlib.ExitStack() as stack:
+                self.api = stack.enter_context(self.lease_sync.connect())
+                self.connection = stack.pop_all()
+        return self.api
+
+    def disconnect(self):
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            connection.close()
+
+    def is_retryable(self, error):
+        # The connection was dropped, the next poll reconnects.
+        return isinstance(error, routeros.RouterOSError) or super().is_retryable(error)
+
+    def poll(self, sheet):
+        """Import new or changed contracts and sync the leases of their devices."""
+        try:
+            return self.poll_router(sheet)
+        except (routeros.RouterOSError, OSError):
+            # Don't reuse a connection that timed out or was closed midway.
+            self.disconnect()
+            raise
+
+    def poll_router(self, sheet):
+        api = self.connect()
+        # Download the spreadsheet while the router lists its leases, only the
+        # sheet's HTTP transport is used by the other thread.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            read_all = executor.submit(sheet.read_all)
+            api.poll_leases()
+            sheet_contracts = read_all.result()
+        contracts = self.import_contracts(sheet_contracts, sheet.errors)
+        contracts += self.update_contracts(sheet_contracts)
+        for device in Device.objects.filter(contract__in=contracts).select_related('contract'):
+            self.stdout.write(f"At {device} of {device.contract}\n")
+            self.lease_sync.handle_device(api, device)
+        self.update_statuses(sheet, sheet_contracts)
+        return contracts
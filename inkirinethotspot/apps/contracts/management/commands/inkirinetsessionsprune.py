@@ -0,0 +1,33 @@
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+
+    help = ("Delete expired sessions from the database in small batches, so "
+            "the database isn't locked for long.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Sessions deleted per transaction (default: 500).")
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help=("Delete all sessions, e.g. the ones left in the database after "
+                  "moving to cookie or cache sessions."))
+
+    def handle(self, *args, **options):
+        sessions = Session.objects.all()
+        if not options['all']:
+            sessions = sessions.filter(expire_date__lt=timezone.now())
+        deleted = 0
+        while True:
+            keys = list(sessions.values_list('pk', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+            deleted += Session.objects.filter(pk__in=keys).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} sessions."))
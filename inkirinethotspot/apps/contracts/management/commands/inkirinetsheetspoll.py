@@ -1,20 +1,84 @@
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.db.models import Q
 from inkirinethotspot.apps.contracts import models
-from inkirinet.sheets import Spreadsheet
+from inkirinet import scheduler
+from inkirinet import sheets
 
 
 class Command(BaseCommand):
 
     help = "Poll contracts from the Google's Spreadsheet."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--daemon',
+            action='store_true',
+            help="Keep polling the spreadsheet instead of polling only once.")
+        parser.add_argument(
+            '--min-interval',
+            type=float,
+            default=10.0,
+            help=("Seconds between polls right after new contracts were found "
+                  "(default: 10)."))
+        parser.add_argument(
+            '--max-interval',
+            type=float,
+            default=300.0,
+            help="Longest seconds between polls when idle (default: 300).")
+        parser.add_argument(
+            '--requests-per-minute',
+            type=float,
+            default=30.0,
+            help=("Sheets API read requests allowed per minute, keep it under "
+                  "the project's quota (default: 30)."))
+        parser.add_argument(
+            '--write-status',
+            action='store_true',
+            help=("Write each row's import and provisioning status back to the "
+                  "spreadsheet's status column."))
+
     def handle(self, *args, **options):
-        sheet = Spreadsheet(**settings.GOOGLE_SHEETS)
-        for sheet_contract in sheet.read_all().values():
-            first_name = sheet_contract.name
-            last_name = ''
-            if ' ' in first_name:
-                first_name, last_name = first_name.split(' ', 1)
+        self.reported_errors = []
+        self.write_status = options['write_status']
+        self.previous_rows = None
+        sheet = sheets.Spreadsheet(**settings.GOOGLE_SHEETS, writable=self.write_status)
+        if not options['daemon']:
+            self.poll(sheet)
+            return
+        rate = options['requests_per_minute'] / 60
+        poller = scheduler.Poller(
+            lambda: self.poll(sheet),
+            budget=scheduler.TokenBucket(rate, capacity=max(1.0, rate * 10)),
+            interval=scheduler.AdaptiveInterval(options['min_interval'],
+                                                options['max_interval']),
+            backoff=scheduler.Backoff(base=options['min_interval'],
+                                      cap=options['max_interval']),
+            is_retryable=self.is_retryable,
+            retry_after=sheets.retry_after)
+        poller.run()
+
+    def is_retryable(self, error):
+        return sheets.is_retryable(error)
+
+    def poll(self, sheet):
+        """Import new or changed contracts from the sheet and return them."""
+        sheet_contracts = sheet.read_all()
+        contracts = self.import_contracts(sheet_contracts, sheet.errors)
+        contracts += self.update_contracts(sheet_contracts)
+        self.update_statuses(sheet, sheet_contracts)
+        return contracts
+
+    def import_contracts(self, sheet_contracts, errors):
+        """Create the contracts (and their devices) missing in the database."""
+        self.report_errors(errors)
+        existing = set(models.Contract.objects.values_list('email', flat=True))
+        contracts = []
+        for sheet_contract in sheet_contracts.values():
+            if sheet_contract.email in existing:
+                continue
+            first_name, last_name = split_name(sheet_contract.name)
             contract, created = models.Contract.objects.get_or_create(
                 email=sheet_contract.email,
                 defaults={
@@ -25,8 +89,97 @@ class Command(BaseCommand):
                     'max_devices': sheet_contract.max_devices,
                 })
             if created:
+                contracts.append(contract)
                 self.stdout.write(self.style.SUCCESS(f"New contract: {contract}."))
                 for mac_address in sheet_contract.devices:
                     device, _ = models.Device.objects.get_or_create(
                         mac_address=mac_address,
                         defaults={'contract': contract})
+        return contracts
+
+    def update_contracts(self, sheet_contracts):
+        """Apply the rows changed since the last poll to their contracts.
+
+        Only rows that changed in the spreadsheet are applied, so the edits
+        made in the admin aren't overwritten on every poll.
+        """
+        previous_rows = self.previous_rows
+        self.previous_rows = {email: row_values(sheet_contract)
+                              for email, sheet_contract in sheet_contracts.items()}
+        if previous_rows is None:
+            return []
+        contracts = []
+        for email, sheet_contract in sheet_contracts.items():
+            if previous_rows.get(email, self.previous_rows[email]) == self.previous_rows[email]:
+                continue
+            contract = models.Contract.objects.filter(email=email).first()
+            if contract is None:
+                continue
+            contract.first_name, contract.last_name = split_name(sheet_contract.name)
+            contract.plan_type = sheet_contract.plan_type
+            contract.is_active = sheet_contract.active
+            contract.max_devices = sheet_contract.max_devices
+            contract.save()
+            contracts.append(contract)
+            self.stdout.write(self.style.SUCCESS(f"Changed contract: {contract}."))
+            for mac_address in sheet_contract.devices:
+                models.Device.objects.get_or_create(mac_address=mac_address,
+                                                    defaults={'contract': contract})
+        return contracts
+
+    def update_statuses(self, sheet, sheet_contracts):
+        if not self.write_status:
+            return
+        written = sheet.write_statuses(
+            self.collect_statuses(sheet_contracts, sheet.errors))
+        if written:
+            self.stdout.write(f"Updated {written} statuses in the spreadsheet.")
+
+    def collect_statuses(self, sheet_contracts, errors):
+        """Return the status string for each row of the spreadsheet."""
+        db_contracts = {
+            email: (is_active, devices_count, leases_count)
+            for email, is_active, devices_count, leases_count
+            in models.Contract.objects
+                     .annotate(devices_total=Count('devices'),
+                               devices_leased=Count('devices',
+                                                    filter=Q(devices__has_lease=True)))
+                     .values_list('email', 'is_active', 'devices_total', 'devices_leased')
+        }
+        statuses = {}
+        for sheet_contract in sheet_contracts.values():
+            if sheet_contract.email not in db_contracts:
+                statuses[sheet_contract.row] = 'Not imported'
+                continue
+            is_active, devices_count, leases_count = db_contracts[sheet_contract.email]
+            if is_active:
+                statuses[sheet_contract.row] = (f'Active: {leases_count}/{devices_count} '
+                                                f'devices provisioned')
+            else:
+                statuses[sheet_contract.row] = 'Inactive'
+        for error in errors:
+            status = statuses.get(error.row)
+            statuses[error.row] = (f'{status}; ' if status else 'Error: ') \
+                + f'{error.field}: {error.reason}'
+        return statuses
+
+    def report_errors(self, errors):
+        """Write the rows that could not be imported, if they changed since last poll."""
+        if errors == self.reported_errors:
+            return
+        for error in errors:
+            self.stderr.write(f"Invalid contract {error}")
+        self.reported_errors = errors
+
+
+def split_name(name):
+    """Split a sheet's full name in the contract's first and last names."""
+    if ' ' in name:
+        return tuple(name.split(' ', 1))
+    return name, ''
+
+
+def row_values(sheet_contract):
+    """Return the values of a sheet contract imported in the database."""
+    return (sheet_contract.name, sheet_contract.plan_type, sheet_contract.active,
+            sheet_contract.max_devices, tuple(sheet_contract.devices))
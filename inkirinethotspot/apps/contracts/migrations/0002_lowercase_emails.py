@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def lowercase_emails(apps, schema_editor):
+    Contract = apps.get_model('contracts', 'Contract')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    emails = set(Contract.objects.values_list('email', flat=True))
+    usernames = set(User.objects.values_list('username', flat=True))
+    for contract in Contract.objects.exclude(email='').select_related('user'):
+        email = contract.email.strip().lower()
+        # Leave duplicates alone, they have to be merged by hand.
+        if email != contract.email and email not in emails:
+            emails.add(email)
+            Contract.objects.filter(pk=contract.pk).update(email=email)
+        # Contract.save() gets the user by the lowercase e-mail, it would
+        # create another one otherwise.
+        user = contract.user
+        username = user.username.strip().lower()
+        if username != user.username and username not in usernames:
+            usernames.add(username)
+            User.objects.filter(pk=user.pk).update(username=username)
+        if user.email != user.email.strip().lower():
+            User.objects.filter(pk=user.pk).update(email=user.email.strip().lower())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contracts', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(lowercase_emails, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.14 on 2026-10-19 15:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contracts', '0002_lowercase_emails'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contract',
+            index=models.Index(fields=['updated_at'], name='contract_updated_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['contract', 'has_lease'], name='device_contract_lease_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['updated_at'], name='device_updated_at_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.14 on 2026-10-19 15:52
+
+from django.db import migrations
+import inkirinethotspot.apps.contracts.fields
+
+from inkirinet import macaddress
+
+
+def normalize_mac_addresses(apps, schema_editor):
+    Device = apps.get_model('contracts', 'Device')
+    mac_addresses = set(Device.objects.values_list('mac_address', flat=True))
+    for pk, mac_address in Device.objects.exclude(mac_address=None).values_list('pk', 'mac_address'):
+        canonical = macaddress.normalize_or_keep(mac_address)
+        # Leave duplicates alone, they have to be merged by hand.
+        if canonical != mac_address and canonical not in mac_addresses:
+            mac_addresses.add(canonical)
+            # By pk, a lookup by the old value would be normalized too.
+            Device.objects.filter(pk=pk).update(mac_address=canonical)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contracts', '0003_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='device',
+            name='mac_address',
+            field=inkirinethotspot.apps.contracts.fields.MACAddressField(null=True, unique=True),
+        ),
+        migrations.RunPython(normalize_mac_addresses, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,22 @@
+import functools
 import logging
 
 import django.contrib.auth
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.cache import cache
+from django.core.cache import caches
 from django.db import models
 from django.db import transaction
+from django.db.models import signals
+from django.dispatch import receiver
+from django.db.models.functions import Greatest
 from django.utils.translation import gettext_lazy as __
 
 from inkirinet import routeros
+from inkirinet import singleflight
+from inkirinet import wiretrace
+from inkirinethotspot.apps.contracts.fields import MACAddressField
 
 
 logger = logging.getLogger(__name__)
@@ -14,12 +24,84 @@ logger = logging.getLogger(__name__)
 User = django.contrib.auth.get_user_model()
 
 
-class ContractManager(models.Manager):
+def get_lease_cache():
+    """Return the cache of MAC addresses by IP address filled by lease polls."""
+    return routeros.LeaseCache(caches[settings.ROUTEROS_LEASE_CACHE['cache']],
+                               timeout=settings.ROUTEROS_LEASE_CACHE['timeout'])
+
+
+@functools.lru_cache(maxsize=None)
+def get_wire_tracer():
+    """Return the RouterOS API tracer, or None if tracing is off."""
+    if not settings.ROUTEROS_WIRE_TRACE:
+        return None
+    return wiretrace.WireTracer(**settings.ROUTEROS_WIRE_TRACE)
+
+
+class ContractQuerySet(models.QuerySet):
+
+    def with_devices_count(self):
+        """Annotate ``devices_count`` and ``devices_allowed`` in SQL.
+
+        :attr:`Contract.devices_count` and :attr:`Contract.devices_allowed`
+        use the annotations instead of querying the database.
+        """
+        return self.annotate(
+            devices_count=models.Count('devices'),
+            devices_allowed=Greatest(models.F('max_devices') - models.Count('devices'),
+                                     models.Value(0),
+                                     output_field=models.IntegerField()))
+
+    def update(self, **kwds):
+        # Updates don't send signals, forget the cached logins of the
+        # contracts updated.
+        if not settings.CONTRACT_LOGIN_CACHE_TIMEOUT:
+            return super().update(**kwds)
+        emails = list(self.values_list('email', flat=True))
+        rows = super().update(**kwds)
+        for email in emails:
+            Contract.objects.forget_login(email)
+        return rows
+
+
+class ContractManager(models.Manager.from_queryset(ContractQuerySet)):
     """Contract model's custom manager."""
 
+    def for_portal(self):
+        """Contracts with their devices prefetched, as shown in the portal."""
+        return self.with_devices_count().prefetch_related(
+            models.Prefetch('devices', queryset=Device.objects.order_by('pk')))
+
+    @staticmethod
+    def normalize_email(email):
+        """Contracts' e-mails are stored in lowercase."""
+        return email.strip().lower() if email else email
+
     def get_from_email(self, email):
-        """Get a Contract from its user's email address."""
-        return self.get(user__username=email)
+        """Get a Contract (and its user) from its email address."""
+        return self.select_related('user').get(email=self.normalize_email(email))
+
+    LOGIN_CACHE_KEY_PREFIX = 'contracts:login:'
+
+    def get_from_email_for_login(self, email):
+        """Like :meth:`get_from_email`, but cached for repeated logins.
+
+        Contracts are kept in the default cache for
+        ``CONTRACT_LOGIN_CACHE_TIMEOUT`` seconds (if set).
+        """
+        timeout = settings.CONTRACT_LOGIN_CACHE_TIMEOUT
+        if not timeout:
+            return self.get_from_email(email)
+        key = self.LOGIN_CACHE_KEY_PREFIX + self.normalize_email(email)
+        contract = cache.get(key)
+        if contract is None:
+            contract = self.get_from_email(email)
+            cache.set(key, contract, timeout)
+        return contract
+
+    def forget_login(self, email):
+        if settings.CONTRACT_LOGIN_CACHE_TIMEOUT and email:
+            cache.delete(self.LOGIN_CACHE_KEY_PREFIX + self.normalize_email(email))
 
     def create_contract(self, email, **extra_attrs):
         """Create a new contract and its attached user."""
@@ -97,20 +179,48 @@ class Contract(models.Model):
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
 
+    # Set when annotated by `ContractQuerySet.with_devices_count()`.
+    _devices_count = None
+    _devices_allowed = None
+
     @property
     def has_devices(self):
+        if self._devices_count is not None:
+            return self._devices_count > 0
+        devices = self._prefetched_devices()
+        if devices is not None:
+            return bool(devices)
         return self.devices.exists()
 
     @property
     def devices_count(self):
+        if self._devices_count is not None:
+            return self._devices_count
+        devices = self._prefetched_devices()
+        if devices is not None:
+            return len(devices)
         return self.devices.count()
 
+    @devices_count.setter
+    def devices_count(self, value):
+        self._devices_count = value
+
     @property
     def devices_allowed(self):
+        if self._devices_allowed is not None:
+            return self._devices_allowed
         allowed = self.max_devices - self.devices_count
         return allowed if allowed >= 0 else 0
 
+    @devices_allowed.setter
+    def devices_allowed(self, value):
+        self._devices_allowed = value
+
+    def _prefetched_devices(self):
+        return getattr(self, '_prefetched_objects_cache', {}).get('devices')
+
     def save(self, **kwds):
+        self.email = Contract.objects.normalize_email(self.email)
         with transaction.atomic():
             self.user, _ = User.objects.get_or_create(
                 username=self.email,
@@ -122,14 +232,62 @@ class Contract(models.Model):
     def __str__(self):
         return f'{self.full_name} <{self.email}>'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='contract_updated_at_idx'),
+        ]
+
 
 class DeviceManager(models.Manager):
 
     logger = logger.getChild('DeviceManager')
 
+    # Concurrent (and repeated within a few seconds) adds, e.g. double
+    # clicks or many tabs, share a single router lookup per IP address and a
+    # single write per contract and device.
+    lookups = singleflight.Group(cooldown=5)
+    add_requests = singleflight.Group(cooldown=5)
+
+    def clear_requests(self):
+        """Forget the lookups and adds kept for their cooldown."""
+        self.lookups.clear()
+        self.add_requests.clear()
+
     def get_or_create_from_ip(self, contract, ip_address):
-        with routeros.connect(**settings.ROUTEROS_API) as api:
-            mac_address = api.get_mac_address_by_dynamic_ip(ip_address)
+        mac_address = self.lookups.do(ip_address, self._get_mac_address, ip_address)
+        return self.add_requests.do((contract.pk, mac_address),
+                                    self.get_or_create_from_mac_address,
+                                    contract, ip_address, mac_address)
+
+    async def aget_or_create_from_ip(self, contract, ip_address):
+        """Like :meth:`get_or_create_from_ip`, without blocking the event loop."""
+        mac_address = await self.lookups.ado(ip_address, self._aget_mac_address, ip_address)
+        return await self.add_requests.ado((contract.pk, mac_address),
+                                           sync_to_async(self.get_or_create_from_mac_address),
+                                           contract, ip_address, mac_address)
+
+    def _get_mac_address(self, ip_address):
+        lease_cache = get_lease_cache()
+        mac_address = lease_cache.get_mac_address(ip_address)
+        if mac_address is None:
+            with routeros.connect(**settings.ROUTEROS_API, tracer=get_wire_tracer()) as api:
+                mac_address = api.get_mac_address_by_dynamic_ip(ip_address)
+            if mac_address is not None:
+                lease_cache.set_mac_address(ip_address, mac_address)
+        return mac_address
+
+    async def _aget_mac_address(self, ip_address):
+        lease_cache = get_lease_cache()
+        mac_address = await sync_to_async(lease_cache.get_mac_address)(ip_address)
+        if mac_address is None:
+            async with routeros.async_connect(**settings.ROUTEROS_API,
+                                              tracer=get_wire_tracer()) as api:
+                mac_address = await api.get_mac_address_by_dynamic_ip(ip_address)
+            if mac_address is not None:
+                await sync_to_async(lease_cache.set_mac_address)(ip_address, mac_address)
+        return mac_address
+
+    def get_or_create_from_mac_address(self, contract, ip_address, mac_address):
         if mac_address is None:
             self.logger.error('add(): could not find the active address for '
                               'the ip provided, ignoring request: ip_address=%s',
@@ -153,6 +311,7 @@ class DeviceManager(models.Manager):
             logger.error("add(): device already belong to this contract, "
                          "ignoring: device='%s' contract='%s' has_lease=%s",
                          device, device.contract, device.has_lease)
+        return device
 
 
 class Device(models.Model):
@@ -166,8 +325,7 @@ class Device(models.Model):
         null=True,
         help_text=__('Contract this device belongs to.'))
 
-    mac_address = models.CharField(
-        max_length=17,
+    mac_address = MACAddressField(
         unique=True,
         null=True)
 
@@ -193,3 +351,37 @@ class Device(models.Model):
 
     def __str__(self):
         return f'{self.mac_address}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['contract', 'has_lease'], name='device_contract_lease_idx'),
+            models.Index(fields=['updated_at'], name='device_updated_at_idx'),
+        ]
+
+
+# Cached logins (see `ContractManager.get_from_email_for_login()`) are
+# forgotten whenever a contract or its user changes.
+
+@receiver(signals.pre_save, sender=Contract)
+def forget_previous_login(sender, instance, **kwds):
+    if settings.CONTRACT_LOGIN_CACHE_TIMEOUT and instance.pk is not None:
+        email = Contract.objects.filter(pk=instance.pk).values_list('email', flat=True).first()
+        if email is not None and email != instance.email:
+            Contract.objects.forget_login(email)
+
+
+@receiver(signals.post_save, sender=Contract)
+@receiver(signals.post_delete, sender=Contract)
+def forget_contract_login(sender, instance, **kwds):
+    Contract.objects.forget_login(instance.email)
+
+
+@receiver(signals.post_save, sender=User)
+@receiver(signals.post_delete, sender=User)
+def forget_user_login(sender, instance, update_fields=None, **kwds):
+    # Each login saves the user's last_login, which doesn't change how it
+    # logs in.
+    if update_fields and update_fields <= {'last_login'}:
+        return
+    Contract.objects.forget_login(instance.username)
+    Contract.objects.forget_login(instance.email)
@@ -0,0 +1,61 @@
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # Optional, install with the "brotli" extra.
+    brotli = None
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Static files storage with content hashed names and precompressed copies.
+
+    ``collectstatic`` copies each file under a name with a hash of its
+    content (e.g. ``base.4b2a6c8f1d3e.css``), so those can be cached for as
+    long as wanted, and writes a ``.gz`` (and a ``.br`` if ``brotli`` is
+    installed) copy next to each hashed text file, so the web server can
+    send them as they are (e.g. nginx's ``gzip_static`` and
+    ``brotli_static``).
+    """
+
+    COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.html', '.txt', '.json',
+                               '.xml', '.map', '.ttf', '.eot', '.otf')
+
+    # Smaller files aren't worth it, the HTTP headers dominate.
+    MIN_SIZE = 256
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(self.hashed_files.values()):
+            if name.lower().endswith(self.COMPRESSIBLE_EXTENSIONS):
+                self.compress(name)
+
+    def compress(self, name):
+        with self.open(name) as f:
+            data = f.read()
+        if len(data) < self.MIN_SIZE:
+            return
+        for extension, compress in self.compressors():
+            compressed = compress(data)
+            if len(compressed) >= len(data):
+                continue
+            if self.exists(name + extension):
+                self.delete(name + extension)
+            self.save(name + extension, ContentFile(compressed))
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            # Not collected (in development or tests), there are no hashed
+            # names.
+            return name
+        return super().stored_name(name)
+
+    @staticmethod
+    def compressors():
+        yield '.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+        if brotli is not None:
+            yield '.br', lambda data: brotli.compress(data, quality=11)
@@ -0,0 +1,8 @@
+# Caches for tests, so they don't touch the ones configured (e.g. the lease
+# cache on disk).
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'test-default'},
+    'routeros': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                 'LOCATION': 'test-routeros'},
+}
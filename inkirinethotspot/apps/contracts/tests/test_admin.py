@@ -0,0 +1,65 @@
+from django.contrib import auth
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .. import models
+
+
+class TestContractAdmin(TestCase):
+
+    url = reverse('admin:contracts_contract_changelist')
+
+    def setUp(self):
+        auth.get_user_model() \
+            .objects \
+            .create_superuser(email='admin@inkirinet.com',
+                              username='admin',
+                              password='supersecret')
+        self.assertTrue(self.client.login(username='admin', password='supersecret'))
+
+    def create_contracts(self, first, last):
+        for i in range(first, last):
+            contract = models.Contract.objects.create_contract(
+                f'contract{i}@example.com', first_name=f'First{i}', last_name=f'Last{i}')
+            contract.devices.create(mac_address=f'mac-address-{i}-1')
+            contract.devices.create(mac_address=f'mac-address-{i}-2')
+
+    def count_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params)
+        self.assertEquals(200, response.status_code)
+        return len(queries), response
+
+    def test_changelist_queries_dont_grow_with_contracts(self):
+        self.create_contracts(0, 2)
+        few, _ = self.count_queries()
+        self.create_contracts(2, 20)
+        many, response = self.count_queries()
+        self.assertEquals(few, many)
+        self.assertLessEqual(many, 8)
+        self.assertContains(response, 'mac-address-19-2')
+
+    def test_search_by_email_prefix(self):
+        self.create_contracts(0, 12)
+        _, response = self.count_queries(q='Contract1')
+        emails = [c.email for c in response.context['cl'].result_list]
+        self.assertEquals(sorted(['contract1@example.com', 'contract10@example.com',
+                                  'contract11@example.com']),
+                          sorted(emails))
+
+    def test_search_by_name_prefix(self):
+        self.create_contracts(0, 3)
+        _, response = self.count_queries(q='last2')
+        emails = [c.email for c in response.context['cl'].result_list]
+        self.assertEquals(['contract2@example.com'], emails)
+
+    def test_search_keeps_filters(self):
+        self.create_contracts(0, 12)
+        models.Contract.objects.filter(email='contract10@example.com').update(is_active=False)
+        models.Contract.objects.exclude(email='contract10@example.com').update(is_active=True)
+        _, response = self.count_queries(q='Contract1', is_active__exact='1')
+        emails = [c.email for c in response.context['cl'].result_list]
+        self.assertEquals(sorted(['contract1@example.com', 'contract11@example.com']),
+                          sorted(emails))
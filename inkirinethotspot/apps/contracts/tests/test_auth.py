@@ -1,4 +1,6 @@
+from django.core.cache import cache
 from django.test import TestCase
+from django.test import override_settings
 
 from .. import auth
 from .. import models
@@ -33,3 +35,64 @@ class TestContractsAuthenticationBackend(TestCase):
         backend = auth.ContractsAuthenticationBackend()
         user = backend.authenticate(None, email)
         self.assertIsNone(user)
+
+    def test_authenticate_is_case_insensitive(self):
+        models.Contract.objects.create_contract('FooBar@Example.com')
+        backend = auth.ContractsAuthenticationBackend()
+        user = backend.authenticate(None, ' foobar@EXAMPLE.com')
+        self.assertIsNotNone(user)
+
+    def test_authenticate_contract_is_a_single_query(self):
+        email = 'foobar@example.com'
+        models.Contract.objects.create_contract(email)
+        backend = auth.ContractsAuthenticationBackend()
+        with self.assertNumQueries(1):
+            contract = backend.authenticate_contract(None, email)
+            self.assertEquals(email, contract.user.username)
+        self.assertEquals('inkirinethotspot.apps.contracts.auth.ContractsAuthenticationBackend',
+                          contract.user.backend)
+
+    @override_settings(CONTRACT_LOGIN_CACHE_TIMEOUT=30)
+    def test_authenticate_contract_when_cached_then_no_query(self):
+        cache.clear()
+        email = 'foobar@example.com'
+        models.Contract.objects.create_contract(email)
+        backend = auth.ContractsAuthenticationBackend()
+        backend.authenticate_contract(None, email)
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(backend.authenticate_contract(None, email))
+
+    @override_settings(CONTRACT_LOGIN_CACHE_TIMEOUT=30)
+    def test_authenticate_contract_when_saved_then_cache_invalidated(self):
+        cache.clear()
+        email = 'foobar@example.com'
+        contract = models.Contract.objects.create_contract(email)
+        backend = auth.ContractsAuthenticationBackend()
+        backend.authenticate_contract(None, email)
+        contract.first_name = 'Foo'
+        contract.save()
+        self.assertEquals('Foo', backend.authenticate_contract(None, email).first_name)
+
+    @override_settings(CONTRACT_LOGIN_CACHE_TIMEOUT=30)
+    def test_authenticate_contract_when_deleted_or_deactivated_then_cache_invalidated(self):
+        cache.clear()
+        backend = auth.ContractsAuthenticationBackend()
+        deleted = models.Contract.objects.create_contract('deleted@example.com')
+        backend.authenticate_contract(None, deleted.email)
+        deleted.delete()
+        self.assertIsNone(backend.authenticate(None, deleted.email))
+        inactive = models.Contract.objects.create_contract('inactive@example.com')
+        backend.authenticate_contract(None, inactive.email)
+        inactive.user.is_active = False
+        inactive.user.save()
+        self.assertIsNone(backend.authenticate(None, inactive.email))
+
+    @override_settings(CONTRACT_LOGIN_CACHE_TIMEOUT=30)
+    def test_authenticate_contract_when_email_updated_then_cache_invalidated(self):
+        cache.clear()
+        email = 'foobar@example.com'
+        models.Contract.objects.create_contract(email)
+        backend = auth.ContractsAuthenticationBackend()
+        backend.authenticate_contract(None, email)
+        models.Contract.objects.filter(email=email).update(email='other@example.com')
+        self.assertIsNone(backend.authenticate(None, email))
@@ -1,14 +1,28 @@
+import datetime
+import os
+import tempfile
 from io import StringIO
 from unittest import mock
 
+from django.contrib.sessions.models import Session
+
 from django.core.management import call_command
 from django.test import TestCase
+from django.test import override_settings
 from django.utils import timezone
 
+from inkirinet.fakerouter import FakeRouter
+from inkirinet.routeros import RouterOSError
 from inkirinet.sheets import Contract
+from inkirinet.sheets import RowError
 from inkirinethotspot.apps.contracts import models
+from inkirinethotspot.apps.contracts.management.commands import inkirinetleasesync
+from inkirinethotspot.apps.contracts.management.commands import inkirinetpipeline
+
+from . import TEST_CACHES
 
 
+@override_settings(CACHES=TEST_CACHES)
 class LeaseSyncTest(TestCase):
 
     out = StringIO()
@@ -23,6 +37,68 @@ class LeaseSyncTest(TestCase):
         self.call_command()
         mikrotik.poll_leases.assert_called_once()
 
+    def test_bulk(self):
+        active = models.Contract.objects.create(email='foo@bar', plan_type='10MB',
+                                                is_active=True)
+        inactive = models.Contract.objects.create(email='baz@bar', plan_type='4MB',
+                                                  is_active=False)
+        models.Device.objects.create(contract=active, mac_address='AA:BB:CC:DD:EE:FF')
+        models.Device.objects.create(contract=inactive, mac_address='11:22:33:44:55:66')
+        models.Device.objects.create(mac_address='22:33:44:55:66:77')
+        with FakeRouter() as router, \
+                override_settings(ROUTEROS_API=router.connection_settings()):
+            dynamic_id = router.add_lease(**{'address': '10.0.0.2', 'dynamic': 'true',
+                                             'mac-address': 'AA:BB:CC:DD:EE:FF'})
+            for mac_address in ('11:22:33:44:55:66', '22:33:44:55:66:77'):
+                router.add_lease(**{'address': 'pool-Manual', 'dynamic': 'false',
+                                    'mac-address': mac_address,
+                                    'comment': '4MB baz@bar @inkirinet'})
+            out = StringIO()
+            call_command('inkirinetleasesync', '--bulk', stdout=out)
+            leases = list(router.leases.values())
+        self.assertIn('2 lease changes applied, 0 failed.', out.getvalue())
+        self.assertNotIn(dynamic_id, [lease['.id'] for lease in leases])
+        self.assertEqual([('AA:BB:CC:DD:EE:FF', '10MB foo@bar @inkirinet')],
+                         [(lease['mac-address'], lease['comment']) for lease in leases])
+        self.assertEqual(['11:22:33:44:55:66'],
+                         [str(d.mac_address) for d in models.Device.objects.all()
+                          if d.contract == inactive and not d.has_lease])
+        self.assertEqual(2, models.Device.objects.count())
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory, FakeRouter() as router, \
+                override_settings(ROUTEROS_API=router.connection_settings()):
+            snapshot = os.path.join(directory, 'leases')
+            router.add_lease(**{'address': '10.0.0.2', 'mac-address': 'AA:BB:CC:DD:EE:FF',
+                                'dynamic': 'true'})
+            call_command('inkirinetleasesync', '--snapshot', snapshot, stdout=self.out)
+            self.assertTrue(os.path.exists(snapshot))
+            out = StringIO()
+            call_command('inkirinetleasesync', '--snapshot', snapshot, stdout=out)
+            self.assertIn('0 new and 0 removed leases', out.getvalue())
+            router.add_lease(**{'address': '10.0.0.3', 'dynamic': 'true'})
+            out = StringIO()
+            call_command('inkirinetleasesync', '--snapshot', snapshot, stdout=out)
+            self.assertIn('1 new and 0 removed leases', out.getvalue())
+
+
+    def test_snapshot_when_lease_updated_then_saved_updated(self):
+        contract = models.Contract.objects.create(email='foo@bar', plan_type='10MB',
+                                                  is_active=True)
+        models.Device.objects.create(contract=contract, mac_address='AA:BB:CC:DD:EE:FF')
+        with tempfile.TemporaryDirectory() as directory, FakeRouter() as router, \
+                override_settings(ROUTEROS_API=router.connection_settings()):
+            snapshot = os.path.join(directory, 'leases')
+            router.add_lease(**{'address': 'pool-Manual', 'dynamic': 'false',
+                                'mac-address': 'AA:BB:CC:DD:EE:FF',
+                                'comment': '4MB foo@bar @inkirinet'})
+            out = StringIO()
+            call_command('inkirinetleasesync', '--snapshot', snapshot, stdout=out)
+            self.assertIn('Static lease updated', out.getvalue())
+            out = StringIO()
+            call_command('inkirinetleasesync', '--snapshot', snapshot, stdout=out)
+            self.assertNotIn('Static lease updated', out.getvalue())
+
 
 class SheetsPollTest(TestCase):
 
@@ -40,3 +116,103 @@ class SheetsPollTest(TestCase):
         self.call_command()
         self.assertEquals(1, models.Contract.objects.count())
         self.assertEqual(contract.email, models.Contract.objects.first().email)
+
+    @mock.patch('inkirinet.sheets.Spreadsheet')
+    def test_write_status(self, SpreadsheetMock):
+        contract = Contract('foo@bar', 'foo', '10MB', True, timezone.now(), 2,
+                            ['AA:BB:CC:DD:EE:FF'], row=2)
+        sheet = SpreadsheetMock.return_value
+        sheet.read_all.return_value = {contract.email: contract}
+        sheet.errors = [RowError(2, 'devices', 'Invalid MAC address.'),
+                        RowError(3, 'email', 'Missing e-mail.')]
+        call_command('inkirinetsheetspoll', '--write-status', stdout=self.out, stderr=StringIO())
+        sheet.write_statuses.assert_called_once_with({
+            2: 'Active: 0/1 devices provisioned; devices: Invalid MAC address.',
+            3: 'Error: email: Missing e-mail.',
+        })
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PipelineTest(TestCase):
+
+    out = StringIO()
+
+    @mock.patch('inkirinet.sheets.Spreadsheet')
+    @mock.patch('inkirinet.routeros.connect')
+    def test_new_contract_devices_get_leases(self, connect_mock, SpreadsheetMock):
+        mikrotik = mock.MagicMock()
+        mikrotik.get_static_lease_by_mac_address.return_value = None
+        connect_mock.return_value.__enter__.return_value = mikrotik
+        contract = Contract('foo@bar', 'foo', '10MB', True, timezone.now(), 2,
+                            ['AA:BB:CC:DD:EE:FF'])
+        SpreadsheetMock.return_value.read_all.return_value = {contract.email: contract}
+        call_command('inkirinetpipeline', stdout=self.out)
+        connect_mock.assert_called_once()
+        mikrotik.poll_leases.assert_called_once()
+        mikrotik.create_static_lease.assert_called_once_with(
+            'pool-Manual', 'foo@bar', 'AA:BB:CC:DD:EE:FF', '10MB', None)
+
+    @mock.patch('inkirinet.routeros.connect')
+    def test_reconnect_and_changed_contract_devices_get_leases(self, connect_mock):
+        mikrotik = mock.MagicMock()
+        mikrotik.get_static_lease_by_mac_address.return_value = None
+        mikrotik.poll_leases.side_effect = [RouterOSError('timed out'), None, None]
+        connect_mock.return_value.__enter__.return_value = mikrotik
+        sheet = mock.MagicMock()
+        sheet.errors = []
+        contract = Contract('foo@bar', 'foo', '10MB', True, timezone.now(), 2,
+                            ['AA:BB:CC:DD:EE:FF'])
+        sheet.read_all.return_value = {contract.email: contract}
+        command = inkirinetpipeline.Command(stdout=self.out)
+        command.lease_sync = inkirinetleasesync.Command(stdout=self.out)
+        command.connection = None
+        command.previous_rows = None
+        command.reported_errors = []
+        command.write_status = False
+
+        with self.assertRaises(RouterOSError):
+            command.poll(sheet)
+        self.assertTrue(command.is_retryable(RouterOSError('timed out')))
+        command.poll(sheet)
+        self.assertEqual(2, connect_mock.call_count)
+
+        mikrotik.create_static_lease.reset_mock()
+        changed = Contract('foo@bar', 'foo', '4MB', True, timezone.now(), 2,
+                           ['AA:BB:CC:DD:EE:FF'])
+        sheet.read_all.return_value = {changed.email: changed}
+        self.assertEqual(1, len(command.poll(sheet)))
+        self.assertEqual('4MB', models.Contract.objects.get().plan_type)
+        mikrotik.create_static_lease.assert_called_once_with(
+            'pool-Manual', 'foo@bar', 'AA:BB:CC:DD:EE:FF', '4MB', None)
+        self.assertEqual(2, connect_mock.call_count)
+
+
+class SessionsPruneTest(TestCase):
+
+    out = StringIO()
+
+    def setUp(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f'expired{i}', session_data='',
+                                   expire_date=now - datetime.timedelta(days=1))
+        Session.objects.create(session_key='valid', session_data='',
+                               expire_date=now + datetime.timedelta(days=1))
+
+    def test_prune_expired(self):
+        call_command('inkirinetsessionsprune', '--batch-size=2', stdout=self.out)
+        self.assertEquals(['valid'], list(Session.objects.values_list('pk', flat=True)))
+
+    def test_prune_all(self):
+        call_command('inkirinetsessionsprune', '--all', stdout=self.out)
+        self.assertFalse(Session.objects.exists())
+
+
+class LoadTestTest(TestCase):
+
+    def test_can_call(self):
+        out = StringIO()
+        call_command('inkirinetloadtest', '--users=2', '--concurrency=1',
+                     '--use-current-database', stdout=out)
+        self.assertIn('POST /add/', out.getvalue())
+        self.assertEquals(2, models.Device.objects.count())
@@ -1,3 +1,4 @@
+from django.core.exceptions import ValidationError
 from django.test import TestCase
 
 from .. import models
@@ -16,6 +17,11 @@ class TestContract(TestCase):
         self.assertIsNotNone(contract)
         self.assertEquals(self.email, contract.email)
 
+    def test_create_contract_normalizes_email(self):
+        contract = models.Contract.objects.create_contract(' FooBar@Example.com')
+        self.assertEquals(self.email, contract.email)
+        self.assertEquals(self.email, contract.user.username)
+
     def test_create_contract_and_get_from_email(self):
         contract = self.create_contract()
         self.assertEquals(self.email, contract.user.username)
@@ -50,6 +56,42 @@ class TestContract(TestCase):
         contract.devices.create(mac_address='bar')
         self.assertEquals(0, contract.devices_allowed)
 
+    def test_with_devices_count(self):
+        contract = self.create_contract()
+        contract.max_devices = 3
+        contract.save()
+        contract.devices.create(mac_address='foo')
+        contract.devices.create(mac_address='bar')
+        models.Contract.objects.create_contract('empty@example.com', max_devices=1)
+        with self.assertNumQueries(1):
+            contracts = {c.email: c for c in models.Contract.objects.with_devices_count()}
+            self.assertEquals(2, contracts[self.email].devices_count)
+            self.assertEquals(1, contracts[self.email].devices_allowed)
+            self.assertTrue(contracts[self.email].has_devices)
+            self.assertEquals(0, contracts['empty@example.com'].devices_count)
+            self.assertEquals(1, contracts['empty@example.com'].devices_allowed)
+            self.assertFalse(contracts['empty@example.com'].has_devices)
+
+    def test_with_devices_count_when_extra_devices(self):
+        contract = self.create_contract()
+        contract.max_devices = 1
+        contract.save()
+        contract.devices.create(mac_address='foo')
+        contract.devices.create(mac_address='bar')
+        contract = models.Contract.objects.with_devices_count().get(pk=contract.pk)
+        self.assertEquals(0, contract.devices_allowed)
+
+    def test_device_mac_address_is_canonical(self):
+        contract = self.create_contract()
+        device = contract.devices.create(mac_address='aa-bb-cc-dd-ee-ff')
+        self.assertEquals('AA:BB:CC:DD:EE:FF', device.mac_address)
+        self.assertEquals(device, models.Device.objects.get(mac_address='aabb.ccdd.eeff'))
+
+    def test_device_mac_address_validation(self):
+        device = models.Device(mac_address='my phone', description='phone')
+        with self.assertRaises(ValidationError):
+            device.full_clean()
+
     def create_contract(self):
         email = 'foobar@example.com'
         contract = models.Contract.objects.create_contract(email)
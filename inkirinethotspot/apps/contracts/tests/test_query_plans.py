@@ -0,0 +1,57 @@
+import datetime
+import unittest
+
+from django.contrib.admin.sites import site
+from django.db import connection
+from django.test import RequestFactory
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from .. import admin
+from .. import models
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'Query plans are checked on SQLite.')
+class TestQueryPlans(TestCase):
+    """Hot queries must be answered from indexes, never scanning a table."""
+
+    def setUp(self):
+        self.contract = models.Contract.objects.create_contract('foobar@example.com')
+        self.contract.devices.create(mac_address='AA:BB:CC:DD:EE:FF')
+        self.since = timezone.now() - datetime.timedelta(hours=1)
+
+    def assertIndexSearch(self, queryset):
+        """Every table in the plan is searched through an index.
+
+        A ``SCAN`` reads the whole table or index, even ``USING INDEX``.
+        """
+        plan = queryset.explain()
+        if 'SEARCH' not in plan or ' SCAN ' in f' {plan} ':
+            self.fail(f'Not an index search in query plan:\n{plan}\nfor query:\n{queryset.query}')
+
+    def test_sync_queries(self):
+        self.assertIndexSearch(models.Device.objects.filter(contract=self.contract,
+                                                            has_lease=False))
+        self.assertIndexSearch(models.Contract.objects.filter(updated_at__gte=self.since))
+        self.assertIndexSearch(models.Device.objects.filter(updated_at__gte=self.since))
+
+    def test_portal_queries(self):
+        self.assertIndexSearch(
+            models.Contract.objects.select_related('user').filter(email='foobar@example.com'))
+        self.assertIndexSearch(
+            models.Contract.objects.with_devices_count().filter(user_id=self.contract.user_id))
+        self.assertIndexSearch(
+            models.Device.objects.filter(contract__in=[self.contract]).order_by('pk'))
+        self.assertIndexSearch(
+            models.Device.objects.filter(mac_address='AA:BB:CC:DD:EE:FF'))
+
+    def test_admin_queries(self):
+        contract_admin = admin.ContractAdmin(models.Contract, site)
+        request = RequestFactory().get(reverse('admin:contracts_contract_changelist'))
+        # Searches by name have to scan, the names aren't indexed.
+        queryset, _ = contract_admin.get_search_results(
+            request, contract_admin.get_queryset(request), 'foobar@')
+        self.assertIndexSearch(queryset)
+        self.assertIndexSearch(
+            models.Contract.objects.filter(email__gte='foo', email__lt='foo\uffff'))
@@ -0,0 +1,43 @@
+import gzip
+import tempfile
+
+from django.test import SimpleTestCase
+
+from .. import storage
+
+
+class TestCompressedManifestStaticFilesStorage(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = storage.CompressedManifestStaticFilesStorage(location=directory.name)
+
+    def post_process(self, files):
+        paths = {}
+        for name, content in files.items():
+            with self.storage.open(name, 'wb') as f:
+                f.write(content)
+            paths[name] = (self.storage, name)
+        return list(self.storage.post_process(paths))
+
+    def test_post_process_hashes_and_compresses_text_files(self):
+        css = b'body { color: black; }\n' * 100
+        processed = self.post_process({'style.css': css})
+        self.assertEquals({'style.css'}, {name for name, _, _ in processed})
+        hashed_name = processed[-1][1]
+        self.assertRegex(hashed_name, r'^style\.[0-9a-f]{12}\.css$')
+        self.assertEquals(hashed_name, self.storage.stored_name('style.css'))
+        with self.storage.open(hashed_name + '.gz') as f:
+            self.assertEquals(css, gzip.decompress(f.read()))
+
+    def test_post_process_skips_small_and_binary_files(self):
+        self.post_process({'small.css': b'body {}',
+                           'image.png': b'\x89PNG' * 200})
+        for name in ('small.css', 'image.png'):
+            hashed_name = self.storage.stored_name(name)
+            self.assertNotEquals(name, hashed_name)
+            self.assertFalse(self.storage.exists(hashed_name + '.gz'))
+
+    def test_stored_name_when_not_collected_then_unhashed(self):
+        self.assertEquals('style.css', self.storage.stored_name('style.css'))
@@ -1,8 +1,17 @@
+import socket
+from unittest import mock
+
 from django.contrib import auth
+from django.core.cache import cache
 from django.test import TestCase
+from django.test import override_settings
 from django.urls import reverse
 
+from inkirinet import routeros
+
+from . import TEST_CACHES
 from .. import models
+from .. import views
 
 
 class TestPublicHome(TestCase):
@@ -170,6 +179,21 @@ class TestAuthenticatedHome(TestCase):
         self.assertContains(response, '<td>mac-address-foo</td>', html=True)
         self.assertContains(response, '<td>max-address-bar</td>', html=True)
 
+    def test_when_get_then_fixed_number_of_queries(self):
+        self.contract.max_devices = 10
+        self.contract.save()
+        self.contract.devices.create(mac_address='mac-address-foo')
+        self.get()
+        for i in range(5):
+            self.contract.devices.create(mac_address=f'mac-address-{i}')
+        # User, contract and its devices.
+        with self.assertNumQueries(3):
+            self.get()
+
+    def test_when_get_then_contract_id_in_session(self):
+        self.get()
+        self.assertEquals(self.contract.pk, self.client.session['_contract_id'])
+
     def get(self):
         response = self.client.get(self.url)
         self.assertEquals(200, response.status_code)
@@ -207,3 +231,116 @@ class TestLoginView(TestCase):
         response = self.client.post(self.url, {'email': email})
         self.assertRedirects(response, reverse('contracts:home'))
         self.assertTrue(auth.get_user(self.client).is_authenticated)
+        self.assertIn('_contract_id', self.client.session)
+
+    @override_settings(CACHES=TEST_CACHES, CONTRACT_LOGIN_CACHE_TIMEOUT=60)
+    def test_when_post_again_then_login_cached(self):
+        email = 'foobar@example.com'
+        models.Contract.objects.create_contract(email)
+        key = models.ContractManager.LOGIN_CACHE_KEY_PREFIX + email
+        for _ in range(2):
+            self.client.logout()
+            response = self.client.post(self.url, {'email': email})
+            self.assertRedirects(response, reverse('contracts:home'))
+            self.assertIsNotNone(cache.get(key))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestAddCurrentDevice(TestCase):
+
+    url = reverse('contracts:add')
+
+    def setUp(self):
+        self.contract = (models.Contract
+                         .objects.create_contract('foobar@example.com'))
+        self.lease_cache = models.get_lease_cache()
+        self.lease_cache.cache.clear()
+        models.Device.objects.clear_requests()
+
+    def mock_router(self, mac_address):
+        async_connect = mock.patch('inkirinet.routeros.async_connect').start()
+        self.addCleanup(mock.patch.stopall)
+        api = async_connect.return_value.__aenter__.return_value
+        api.get_mac_address_by_dynamic_ip = mock.AsyncMock(return_value=mac_address)
+        return api
+
+    def test_when_anonymous_then_redirect_to_login(self):
+        response = self.client.post(self.url)
+        self.assertRedirects(response,
+                             reverse('contracts:login') + '?next=' + reverse('contracts:home'))
+
+    def test_when_get_then_not_allowed(self):
+        self.assertTrue(self.client.login(contract_email='foobar@example.com'))
+        self.assertEquals(405, self.client.get(self.url).status_code)
+
+    def test_when_post_then_device_created(self):
+        api = self.mock_router('AA:BB:CC:DD:EE:FF')
+        self.assertTrue(self.client.login(contract_email='foobar@example.com'))
+        response = self.client.post(self.url, REMOTE_ADDR='10.0.0.2')
+        self.assertRedirects(response, reverse('contracts:home'))
+        api.get_mac_address_by_dynamic_ip.assert_awaited_once_with('10.0.0.2')
+        self.assertEquals(['AA:BB:CC:DD:EE:FF'],
+                          [d.mac_address for d in self.contract.devices.all()])
+        self.assertEquals('AA:BB:CC:DD:EE:FF', self.lease_cache.get_mac_address('10.0.0.2'))
+
+    def test_when_post_and_cached_then_no_router_lookup(self):
+        api = self.mock_router(None)
+        self.lease_cache.set_mac_address('10.0.0.2', 'AA:BB:CC:DD:EE:FF')
+        self.assertTrue(self.client.login(contract_email='foobar@example.com'))
+        self.client.post(self.url, REMOTE_ADDR='10.0.0.2')
+        api.get_mac_address_by_dynamic_ip.assert_not_awaited()
+        self.assertTrue(self.contract.has_devices)
+
+    def test_when_post_twice_then_single_lookup(self):
+        api = self.mock_router('AA:BB:CC:DD:EE:FF')
+        self.assertTrue(self.client.login(contract_email='foobar@example.com'))
+        self.client.post(self.url, REMOTE_ADDR='10.0.0.2')
+        self.lease_cache.cache.clear()
+        self.client.post(self.url, REMOTE_ADDR='10.0.0.2')
+        api.get_mac_address_by_dynamic_ip.assert_awaited_once_with('10.0.0.2')
+
+    def test_when_other_contract_posts_same_ip_then_single_lookup(self):
+        api = self.mock_router('AA:BB:CC:DD:EE:FF')
+        models.Contract.objects.create_contract('other@example.com')
+        self.assertTrue(self.client.login(contract_email='foobar@example.com'))
+        self.client.post(self.url, REMOTE_ADDR='10.0.0.2')
+        self.lease_cache.cache.clear()
+        self.assertTrue(self.client.login(contract_email='other@example.com'))
+        with self.assertLogs(models.logger, 'ERROR'):
+            self.client.post(self.url, REMOTE_ADDR='10.0.0.2')
+        api.get_mac_address_by_dynamic_ip.assert_awaited_once_with('10.0.0.2')
+        self.assertTrue(self.contract.has_devices)
+
+    def test_when_router_times_out_then_message(self):
+        api = self.mock_router(None)
+        api.get_mac_address_by_dynamic_ip.side_effect = routeros.RouterOSTimeoutError()
+        self.assertTrue(self.client.login(contract_email='foobar@example.com'))
+        with self.assertLogs('inkirinethotspot.apps.contracts.views', 'WARNING'):
+            response = self.client.post(self.url, REMOTE_ADDR='10.0.0.2', follow=True)
+        self.assertRedirects(response, reverse('contracts:home'))
+        self.assertEquals([str(views.ROUTER_UNAVAILABLE)],
+                          [str(m) for m in response.context['messages']])
+        self.assertFalse(self.contract.has_devices)
+
+    def test_when_router_refuses_connection_then_message(self):
+        with socket.socket() as unused:
+            unused.bind(('127.0.0.1', 0))
+            port = unused.getsockname()[1]
+        self.assertTrue(self.client.login(contract_email='foobar@example.com'))
+        with override_settings(ROUTEROS_API={'host': '127.0.0.1', 'port': port,
+                                             'username': 'fake', 'password': 'fake',
+                                             'disable_ssl': True}), \
+                self.assertLogs('inkirinethotspot.apps.contracts.views', 'WARNING'):
+            response = self.client.post(self.url, REMOTE_ADDR='10.0.0.2', follow=True)
+        self.assertRedirects(response, reverse('contracts:home'))
+        self.assertEquals([str(views.ROUTER_UNAVAILABLE)],
+                          [str(m) for m in response.context['messages']])
+        self.assertFalse(self.contract.has_devices)
+
+    def test_when_post_and_no_lease_then_no_device(self):
+        self.mock_router(None)
+        self.assertTrue(self.client.login(contract_email='foobar@example.com'))
+        with self.assertLogs(models.logger, 'ERROR'):
+            response = self.client.post(self.url, REMOTE_ADDR='10.0.0.2')
+        self.assertRedirects(response, reverse('contracts:home'))
+        self.assertFalse(self.contract.has_devices)
@@ -4,11 +4,13 @@ from django.urls import path
 from .apps import ContractsConfig
 from .views import HomeView
 from .views import LoginView
+from .views import add_current_device
 
 
 app_name = ContractsConfig.name
 
 urlpatterns = [
     path('', HomeView.as_view(), name='home'),
+    path('add/', add_current_device, name='add'),
     path('login/', LoginView.as_view(), name='login')
 ]
@@ -1,28 +1,77 @@
 import logging
 
+from asgiref.sync import sync_to_async
+from django.contrib import messages
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.mixins import UserPassesTestMixin
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponseNotAllowed
 from django.http import HttpResponseRedirect
 from django.urls import reverse
+from django.utils.translation import gettext_lazy as __
 from django.views.generic import FormView
 
+from inkirinet import routeros
+
 from .forms import ContractLoginForm
 from .forms import DevicesFormset
+from .models import Contract
 from .models import Device
 
 
 logger = logging.getLogger(__name__)
 
 
+CONTRACT_SESSION_KEY = '_contract_id'
+
+
+def get_request_contract(request):
+    """Return the contract of the request's user (with its devices), or None.
+
+    The contract id is kept in the session, so it is fetched by primary key
+    after the first request.
+    """
+    if not request.user.is_authenticated:
+        return None
+    contracts = Contract.objects.for_portal().filter(user_id=request.user.pk)
+    contract_id = request.session.get(CONTRACT_SESSION_KEY)
+    if contract_id is not None:
+        try:
+            return contracts.get(pk=contract_id)
+        except Contract.DoesNotExist:
+            pass
+    # Assume user and contract are 1:1.
+    contract = contracts.first()
+    if contract is not None:
+        request.session[CONTRACT_SESSION_KEY] = contract.pk
+    return contract
+
+
+def get_request_ip(request):
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        ip = x_forwarded_for.split(',')[-1].strip()
+    else:
+        ip = request.META.get('REMOTE_ADDR')
+    return ip
+
+
+ROUTER_UNAVAILABLE = __("We couldn't reach the network to find your device, "
+                        "please try again in a moment.")
+
+
+def router_unavailable(request, ip_address, error):
+    """Tell the user the device could not be added, instead of failing."""
+    logger.warning('add(): router unavailable, ignoring request: '
+                   'ip_address=%s error=%s', ip_address, error)
+    messages.error(request, ROUTER_UNAVAILABLE)
+
+
 class OneToOneContractRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
 
     def test_func(self):
-        if self.request.user.contracts.exists():
-            # Assume user and contract are 1:1.
-            self.request.contract = self.request.user.contracts.first()
-        else:
-            self.request.contract = None
+        self.request.contract = get_request_contract(self.request)
         return bool(self.request.contract)
 
 
@@ -38,19 +87,13 @@ class HomeView(OneToOneContractRequiredMixin, FormView):
         return reverse('contracts:home')
 
     def get_request_ip(self):
-        x_forwarded_for = self.request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[-1].strip()
-        else:
-            ip = self.request.META.get('REMOTE_ADDR')
-        return ip
+        return get_request_ip(self.request)
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
-        if self.request.method in ('GET',):
-            kwargs.update({
-                'queryset': self.request.contract.devices.all()
-            })
+        kwargs.update({
+            'queryset': self.request.contract.devices.all()
+        })
         return kwargs
 
     def get_context_data(self, **kwargs):
@@ -89,11 +132,38 @@ class HomeView(OneToOneContractRequiredMixin, FormView):
 
     def add_current_device(self):
         ip_address = self.get_request_ip()
-        Device.objects.get_or_create_from_ip(self.request.contract, ip_address)
+        try:
+            Device.objects.get_or_create_from_ip(self.request.contract, ip_address)
+        except routeros.RouterOSError as error:
+            router_unavailable(self.request, ip_address, error)
         return HttpResponseRedirect(self.get_success_url())
 
 
+async def add_current_device(request):
+    """Register the device making the request in the user's contract.
+
+    The router lookup doesn't block the worker, when served through ASGI a
+    single process can handle many concurrent requests.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    contract = await sync_to_async(get_request_contract)(request)
+    if contract is None:
+        return redirect_to_login(reverse('contracts:home'))
+    ip_address = get_request_ip(request)
+    try:
+        await Device.objects.aget_or_create_from_ip(contract, ip_address)
+    except routeros.RouterOSError as error:
+        router_unavailable(request, ip_address, error)
+    return HttpResponseRedirect(reverse('contracts:home'))
+
+
 class LoginView(auth_views.LoginView):
 
     authentication_form = ContractLoginForm
     template_name = 'contracts/login.html'
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        self.request.session[CONTRACT_SESSION_KEY] = form.contract.pk
+        return response
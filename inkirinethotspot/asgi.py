@@ -3,6 +3,9 @@ ASGI config for inkirinethotspot project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the portal through an ASGI server (e.g. uvicorn) so the asynchronous
+"add current device" view waits on the router without holding a worker.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 """
@@ -81,6 +81,34 @@ DATABASES = {
     }
 }
 
+# Caches
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by the lease sync and the portal processes.  It holds the whole
+    # leases table under a single key, plus an entry per address looked up in
+    # the router between polls.  For processes in different hosts use
+    # memcached, e.g. 'django.core.cache.backends.memcached.PyLibMCCache'.
+    'routeros': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'routeros',
+    },
+}
+
+# Sessions
+# https://docs.djangoproject.com/en/3.1/topics/http/sessions/
+#
+# Portal sessions are tiny (the user and contract ids), keep them in signed
+# cookies so logins don't write to the database.  Use
+# 'django.contrib.sessions.backends.cache' (with a cache shared by all
+# workers) to be able to revoke sessions server side, and prune the leftovers
+# of database sessions with `inkirinetsessionsprune`.
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+
 # Authentication
 
 AUTHENTICATION_BACKENDS = [
@@ -90,6 +118,10 @@ AUTHENTICATION_BACKENDS = [
 
 LOGIN_REDIRECT_URL = '/'
 
+# Seconds to keep contracts in the cache for repeated logins (0 disables).
+
+CONTRACT_LOGIN_CACHE_TIMEOUT = 0
+
 LOGIN_URL = '/login/'
 
 # Password validation
@@ -130,13 +162,43 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
-# RouterOS.
+STATIC_ROOT = BASE_DIR / 'static'
+
+# Collected files get content hashed names and precompressed (gzip/brotli)
+# copies, serve the hashed names with long-lived cache headers, see
+# README.rst.
+
+STATICFILES_STORAGE = ('inkirinethotspot.apps.contracts.storage.'
+                       'CompressedManifestStaticFilesStorage')
+
+# RouterOS.  With SSL, pin the router's certificate with 'ssl_fingerprint'
+# (its SHA-256) or verify it with 'ssl_cafile', without either the connection
+# is encrypted but not authenticated.
 
 ROUTEROS_API = {'host': '127.0.0.1',
                 'port': 8728,
                 'username': 'username',
                 'password': 'password',
-                'disable_ssl': True}
+                'disable_ssl': True,
+                # Seconds to connect and login, then to answer each read.
+                'timeout': 10}
+
+# Trace RouterOS API commands to a rotating file, as JSON lines, e.g.
+# {'path': BASE_DIR / 'routeros-wire.log', 'sample_rate': 0.1}, see
+# `inkirinet.wiretrace.WireTracer` for the other options.  Passwords are not
+# written.
+
+ROUTEROS_WIRE_TRACE = None
+
+# Limit static leases through a shared queue per plan (see
+# `Mikrotik.ensure_plan_queues`) instead of a queue per lease.
+
+ROUTEROS_QUEUE_MODE = False
+
+# MAC addresses of the bound dynamic leases by IP, filled by the lease polls.
+
+ROUTEROS_LEASE_CACHE = {'cache': 'routeros',
+                        'timeout': 120}
 
 # Google Sheets.
 